@@ -1,8 +1,7 @@
 import os
 import sys
 import re
-import json
-import tempfile
+import csv
 import getpass
 
 import kbr.args_utils as args_utils
@@ -16,6 +15,13 @@ import cromwell.api as cromwell_api
 import cromwell.facade as cromwell_facade
 import cromwell.utils as cromwell_utils
 import cromwell.json_utils as json_utils
+import cromwell.scheduler as cromwell_scheduler
+
+# when set submissions are added to this queue file, see cromwell.scheduler, instead of going to the server directly
+queue_file = None
+
+# when set submissions get a fingerprint label, and are skipped if a live workflow with the same fingerprint exists
+idempotent = False
 
 
 def find_bam_index(bamfile:str) -> str:
@@ -34,54 +40,123 @@ def find_bam_index(bamfile:str) -> str:
         raise RuntimeError(f"Index file for amfile {bamfile} not found! [{index_file},{bamfile+'.bai'}")
 
 
+def outdir_json(outdir:str=None) -> dict:
 
+    return None
 
-def write_tmp_json(data) -> str:
+    if outdir is None:
+        return None
 
-    tmpfile = tempfile.NamedTemporaryFile(mode="w", delete=False)
-    json.dump(data, tmpfile.file)
-    tmpfile.close()
+    return {"final_workflow_outputs_dir": outdir, "use_relative_output_paths": True}
 
-    return tmpfile.name
+def labels_json(workflow:str, env:str, sample:str=None, outdir:str=None ) -> dict:
 
+    data = {"env": env, "user": getpass.getuser(), "workflow": workflow}
 
-def outdir_json(outdir:str=None) -> str:
+    if sample is not None:
+        data['sample'] = re.sub(r'.*\/', '', sample)
 
-    return None
+    if outdir is not None:
+        data['outdir'] = outdir
 
-    if outdir is None:
+    return data
+
+
+def dependency(wdl_zip:str=None) -> bytes:
+    if wdl_zip is None:
         return None
 
-    return write_tmp_json({"final_workflow_outputs_dir": outdir, "use_relative_output_paths": True})
+    return cromwell_utils.dependency_zip(wdl_zip)
 
-def labels_json(workflow:str, env:str, sample:str, outdir:str=None ) -> str:
 
-    sample = re.sub(r'.*\/', '', sample)
+def submit(wdl_wf:str, inputs:dict, options:dict=None, labels:dict=None, wdl_zip:str=None) -> dict:
+    ''' submits a single workflow, or adds it to the submission queue if one is in use '''
 
-    data = {"env": env, "user": getpass.getuser(), "workflow": workflow, 'sample':sample}
+    if idempotent:
+        fingerprint = cromwell_utils.fingerprint(cromwell_utils.wdl_workflow_imports(wdl_wf), inputs)
+        labels = dict(labels or {}, fingerprint=fingerprint)
 
-    if outdir is not None:
-        data['outdir'] = outdir
+        # a queued entry is checked when it is submitted
+        existing = cromwell_facade.fingerprint_workflow(fingerprint) if queue_file is None else None
+        if existing is not None:
+            print(f"{existing['id']} is already {existing['status']} with the same workflow and inputs")
+            return existing
 
-    return write_tmp_json(data)
+    if queue_file is not None:
+        cromwell_scheduler.enqueue(queue_file, wdl_wf, inputs, options, labels, wdl_zip)
+        return {'id': 'queued', 'status': 'Queued'}
 
+    return cromwell_api.submit_workflow(wdl_file=cromwell_utils.wdl_workflow_imports(wdl_wf), inputs=[inputs], options=options,
+                                        labels=labels, dependency=dependency(wdl_zip))
 
-def del_files(*files) -> None:
-    for f in files:
-        if f is not None and os.path.isfile( f ):
-            os.remove(f)
 
-def exome_genome(analysis:str, args:list, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None,) -> None:
+def batch_submit(samples:list, workflow:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None, batch_size:int=50) -> dict:
+    ''' submits (sample-name, inputs) pairs through the batch endpoint, batch_size samples per request.
 
-    name = args_utils.get_or_fail(args, "Sample name is missing")
-    args_utils.min_count(1, len(args), msg="One or more ubams required.")
+    The workflow source and dependency zip are uploaded once per batch rather than once per sample. Labels are shared
+    by a batch, so the sample label is set on each workflow after the submission.
+    '''
+
+    options = outdir_json( outdir )
+
+    if queue_file is not None:
+        res = {}
+        for name, inputs in samples:
+            res[ name ] = submit(wdl_wf, inputs, options, labels_json(workflow=workflow, env=env, sample=name, outdir=outdir), wdl_zip)
+        return res
+
+    labels = labels_json(workflow=workflow, env=env, outdir=outdir)
+    wf_source = cromwell_utils.wdl_workflow_imports(wdl_wf)
+
+    res = {}
+    fingerprints = {}
+    if idempotent:
+        todo = []
+        for name, inputs in samples:
+            fingerprints[ name ] = cromwell_utils.fingerprint(wf_source, inputs)
+            existing = cromwell_facade.fingerprint_workflow(fingerprints[ name ])
+            if existing is not None:
+                print(f"{name}\t{existing['id']} is already {existing['status']} with the same workflow and inputs")
+                res[ name ] = existing
+            else:
+                todo.append((name, inputs))
+        samples = todo
+
+    for i in range(0, len(samples), batch_size):
+        batch = samples[i:i+batch_size]
+        inputs = [sample_inputs for _, sample_inputs in batch]
+
+        sts = cromwell_api.batch_submit_workflow(wdl_file=wf_source, inputs=inputs, options=options, labels=labels, dependency=dependency(wdl_zip))
+
+        if not isinstance(sts, list):
+            # the whole batch failed
+            sts = [sts] * len(batch)
+
+        for (name, _), st in zip(batch, sts):
+            res[ name ] = st
+            if st['status'] == 'Submitted':
+                sample_labels = {'sample': re.sub(r'.*\/', '', name)}
+                if name in fingerprints:
+                    sample_labels['fingerprint'] = fingerprints[ name ]
+                lst = cromwell_api.workflow_labels_set(st['id'], sample_labels)
+                if 'labels' not in lst:
+                    # without them the workflow cannot be found by sample or by the duplicate check
+                    print(f"{name}\t{st['id']}: could not set the {', '.join(sample_labels)} labels: {lst.get('status', None)}")
+                    res[ name ] = dict(st, label_error=lst.get('status', None))
+            print(f"{name}\t{st['id']}: {st['status']}")
+
+    return res
+
+
+def exome_genome_inputs(analysis:str, name:str, args:list, reference:str, check_files:bool=True) -> dict:
 
     infiles = []
     for arg in args:
-        if not re.match(r'^.*\.ubam', arg):
-            raise RuntimeError(f"{arg} have a wrong suffix, should be '.ubam'")
-        if not os.path.isfile(arg):
-            raise RuntimeError(f"cannot find {arg}")
+        if check_files:
+            if not re.match(r'^.*\.ubam', arg):
+                raise RuntimeError(f"{arg} have a wrong suffix, should be '.ubam'")
+            if not os.path.isfile(arg):
+                raise RuntimeError(f"cannot find {arg}")
         arg = os.path.abspath(arg)
         infiles.append(arg)
 
@@ -93,42 +168,156 @@ def exome_genome(analysis:str, args:list, reference:str, wdl_wf:str, wdl_zip:str
             ]
 
 
-    if analysis == 'genome':
-        indata['WGS'] = True
-        indata['doBSQR'] = True
-
     data = json_utils.build_json(indata, "DNAProcessing")
 
+    if analysis == 'genome':
+        data["DNAProcessing"]['WGS'] = True
+        data["DNAProcessing"]['doBSQR'] = True
+
     data["DNAProcessing"]['sample_and_unmapped_bams']['unmapped_bams'] = []
     for infile in infiles:
         data["DNAProcessing"]['sample_and_unmapped_bams']['unmapped_bams'].append( infile )
 
     
     data = json_utils.add_jsons(data, [reference], "DNAProcessing")
-    data = json_utils.pack(data, 2)
+    return json_utils.pack(data, 2)
+
+
+def exome_genome(analysis:str, args:list, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None,) -> None:
 
-    tmp_inputs = write_tmp_json( data )
-    tmp_options = outdir_json( outdir )
-    tmp_labels = labels_json(workflow=analysis, env=env,sample=name, outdir=outdir)
-    tmp_wf_file = cromwell_utils.fix_wdl_workflow_imports(wdl_wf)
+    name = args_utils.get_or_fail(args, "Sample name is missing")
+    args_utils.min_count(1, len(args), msg="One or more ubams required.")
 
-    st = cromwell_api.submit_workflow(wdl_file=tmp_wf_file, inputs=[tmp_inputs], options=tmp_options, labels=tmp_labels, dependency=wdl_zip)
+    data = exome_genome_inputs(analysis, name, args, reference)
+
+    options = outdir_json( outdir )
+    labels = labels_json(workflow=analysis, env=env,sample=name, outdir=outdir)
+
+    st = submit(wdl_wf, data, options, labels, wdl_zip)
     print(f"{st['id']}: {st['status']}")
-    del_files( tmp_inputs, tmp_options, tmp_labels, tmp_wf_file)
 
 
 
-def exomes_genomes(analysis:str, args:list, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None,) -> None:
+def exomes_genomes(analysis:str, args:list, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None,
+                   batch_size:int=0) -> dict:
 
     args_utils.min_count(1, len(args), msg="One or more ubams required.")
 
+    samples = []
     for arg in args:
         sample_name = re.sub('\..*', '', arg)
         sample_name = re.sub('.*\/', '', sample_name)
         print( sample_name, arg)
-        exome_genome(analysis, [sample_name, arg], reference, wdl_wf, wdl_zip, outdir, env,)
+        if batch_size > 0:
+            samples.append((sample_name, exome_genome_inputs(analysis, sample_name, [arg], reference)))
+        else:
+            exome_genome(analysis, [sample_name, arg], reference, wdl_wf, wdl_zip, outdir, env,)
+
+    if samples:
+        return batch_submit(samples, analysis, wdl_wf, wdl_zip, outdir, env, batch_size=batch_size)
+
+
 
 
+def read_sample_sheet(sheet:str) -> dict:
+    ''' sample -> [files] from a tsv/csv file with a header line containing a sample and a file column, a sample can span several rows '''
+
+    delimiter = ',' if sheet.endswith('.csv') else '\t'
+
+    samples = {}
+    with open(sheet, newline='') as fh:
+        for row in csv.DictReader(fh, delimiter=delimiter):
+            if 'sample' not in row or 'file' not in row:
+                raise RuntimeError(f"{sheet} needs a 'sample' and a 'file' column")
+            if not row['sample'] or row['sample'].startswith('#'):
+                continue
+            samples.setdefault(row['sample'].strip(), []).append(row['file'].strip())
+
+    return samples
+
+
+def validate_file(filename:str, suffix:str, index:bool=False) -> list:
+    ''' list of problems with an input file, empty if it is ok '''
+
+    if not filename.endswith(suffix):
+        return [f"{filename} have a wrong suffix, should be '{suffix}'"]
+
+    try:
+        if os.stat(filename).st_size == 0:
+            return [f"{filename} is empty"]
+    except OSError:
+        return [f"cannot find {filename}"]
+
+    if index:
+        try:
+            find_bam_index(filename)
+        except RuntimeError as e:
+            return [str(e)]
+
+    return []
+
+
+def sample_sheet(analysis:str, sheet:str, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None,
+                 batch_size:int=0) -> dict:
+    ''' submits a workflow per sample in the sheet, nothing is submitted unless all files are valid '''
+
+    samples = read_sample_sheet(sheet)
+    if not samples:
+        raise RuntimeError(f"no samples found in {sheet}")
+
+    if analysis == 'haplotypecaller':
+        for name, files in samples.items():
+            if len(files) != 1:
+                raise RuntimeError(f"{name}: haplotypecaller takes a single bamfile, got {len(files)}")
+        suffix, index = '.bam', True
+    else:
+        suffix, index = '.ubam', False
+
+    # the stat calls are slow on a parallel filesystem, so the files are checked concurrently
+    filenames = sorted({f for files in samples.values() for f in files})
+    problems = cromwell_facade.fan_out(validate_file, filenames, suffix=suffix, index=index)
+    problems = [p for ps in problems for p in ps]
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        raise RuntimeError(f"{len(problems)} problems with the input files in {sheet}")
+
+    inputs = []
+    for name, files in samples.items():
+        if analysis == 'haplotypecaller':
+            bamfile = os.path.abspath(files[0])
+            inputs.append((name, haplotypecaller_inputs(name, bamfile, find_bam_index(bamfile), reference)))
+        else:
+            inputs.append((name, exome_genome_inputs(analysis, name, files, reference, check_files=False)))
+
+    workflow = 'variantcalling' if analysis == 'haplotypecaller' else analysis
+
+    if batch_size > 0:
+        return batch_submit(inputs, workflow, wdl_wf, wdl_zip, outdir, env, batch_size=batch_size)
+
+    res = {}
+    for name, data in inputs:
+        options = outdir_json( outdir )
+        labels = labels_json(workflow=workflow, env=env, sample=name, outdir=outdir)
+        st = submit(wdl_wf, data, options, labels, wdl_zip)
+        print(f"{name} {st['id']}: {st['status']}")
+        res[name] = st
+
+    return res
+
+
+def haplotypecaller_inputs(name:str, bamfile:str, bam_index:str, reference:str) -> dict:
+
+    indata = [f'input_bam={bamfile}',
+              f'input_bam_index={bam_index}',
+              f'sample_name={name}',
+              "scatter_settings.haplotype_scatter_count=10",
+              "scatter_settings.break_bands_at_multiples_of=0"
+            ]
+
+    data = json_utils.build_json(indata, "VariantCalling")
+    data = json_utils.add_jsons(data, [reference], "VariantCalling")
+    return json_utils.pack(data, 2)
 
 
 def haplotypecaller(args:list, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None,) -> None:
@@ -146,41 +335,28 @@ def haplotypecaller(args:list, reference:str, wdl_wf:str, wdl_zip:str=None, outd
         arg = os.path.abspath(arg)
         infiles.append(arg)
 
-    indata = [f'input_bam={bamfile}',
-              f'input_bam_index={bam_index}',
-              f'sample_name={name}',
-              "scatter_settings.haplotype_scatter_count=10",
-              "scatter_settings.break_bands_at_multiples_of=0"
-            ]
-
+    data = haplotypecaller_inputs(name, bamfile, bam_index, reference)
 
-    data = json_utils.build_json(indata, "VariantCalling")
-    data = json_utils.add_jsons(data, [reference], "VariantCalling")
-    data = json_utils.pack(data, 2)
-
-    tmp_inputs = write_tmp_json( data )
-    tmp_options = outdir_json( outdir )
-    tmp_labels = labels_json(workflow='variantcalling', env=env, sample=name, outdir=outdir)
-    tmp_wf_file = cromwell_utils.fix_wdl_workflow_imports(wdl_wf)
+    options = outdir_json( outdir )
+    labels = labels_json(workflow='variantcalling', env=env, sample=name, outdir=outdir)
 
-    st = cromwell_api.submit_workflow(wdl_file=tmp_wf_file, inputs=[tmp_inputs], options=tmp_options, labels=tmp_labels, dependency=wdl_zip)
+    st = submit(wdl_wf, data, options, labels, wdl_zip)
     print(f"{st['id']}: {st['status']}")
-    del_files( tmp_inputs, tmp_options, tmp_labels, tmp_wf_file)
 
-def bams_to_ubams(args:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None ) -> None:
+def bams_to_ubams(args:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None, batch_size:int=0) -> dict:
+
+    if batch_size > 0:
+        samples = [(arg, {"BamToUnalignedBam.input_bam": os.path.abspath( arg )}) for arg in args]
+        return batch_submit(samples, 'bams-to-ubams', wdl_wf, wdl_zip, outdir, env, batch_size=batch_size)
     
-    tmp_options = outdir_json( outdir )
-    tmp_wf_file = cromwell_utils.fix_wdl_workflow_imports(wdl_wf)
+    options = outdir_json( outdir )
 
     for arg in args:
         data = {"BamToUnalignedBam.input_bam": os.path.abspath( arg )}
-        tmp_inputs = write_tmp_json( data )
-        tmp_labels = labels_json(workflow='bams-to-ubams', env=env, sample=arg, outdir=outdir)
-        st = cromwell_api.submit_workflow(wdl_file=tmp_wf_file, inputs=[tmp_inputs], options=tmp_options, labels=tmp_labels, dependency=wdl_zip)
-        del_files( tmp_inputs, tmp_labels)
+        labels = labels_json(workflow='bams-to-ubams', env=env, sample=arg, outdir=outdir)
+        st = submit(wdl_wf, data, options, labels, wdl_zip)
 
 
-    del_files( tmp_options, tmp_wf_file)
 
 
 def fqs_to_ubam(args:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str=None ) -> None:
@@ -201,13 +377,10 @@ def fqs_to_ubam(args:str, wdl_wf:str, wdl_zip:str=None, outdir:str=None, env:str
     if fq_rev is not None:
         data["FqToUnalignedBam.fq_rev"] = fq_rev 
 
-    tmp_options = outdir_json( outdir )
-    tmp_wf_file = cromwell_utils.fix_wdl_workflow_imports(wdl_wf)
-    tmp_inputs = write_tmp_json( data )
-    tmp_labels = labels_json(workflow='fqs-to-ubam', env=env, sample=out_name, outdir=outdir)
-    st = cromwell_api.submit_workflow(wdl_file=tmp_wf_file, inputs=[tmp_inputs], options=tmp_options, labels=tmp_labels, dependency=wdl_zip)
+    options = outdir_json( outdir )
+    labels = labels_json(workflow='fqs-to-ubam', env=env, sample=out_name, outdir=outdir)
+    st = submit(wdl_wf, data, options, labels, wdl_zip)
     print(f"{st['id']}: {st['status']}")
-    del_files( tmp_inputs, tmp_options, tmp_labels, tmp_wf_file)
 
 
 
@@ -218,9 +391,6 @@ def salmon(args:str, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=Non
     fwd_reads = args_utils.get_or_fail(args, "fwd-reads file missing")
     rev_reads = args_utils.get_or_default(args, None)
 
-    tmp_wdl_file = cromwell_utils.patch_workflow_imports_for_running(wdl_wf)
-#    print( tmp_wdl_file )
-
     indata = {'Salmon.sample_name': name,
               "Salmon.fwd_reads": os.path.abspath(fwd_reads),
               "Salmon.threads": 6,
@@ -229,14 +399,11 @@ def salmon(args:str, reference:str, wdl_wf:str, wdl_zip:str=None, outdir:str=Non
     if rev_reads is not None:
         indata["Salmon.rev_reads"] = os.path.abspath(rev_reads)
 
-    tmp_inputs = write_tmp_json( indata )
-    tmp_options = outdir_json( outdir )
-    tmp_labels = labels_json(workflow='salmon', env=env, sample=name, outdir=outdir)
-    tmp_wf_file = cromwell_utils.fix_wdl_workflow_imports(wdl_wf)
+    options = outdir_json( outdir )
+    labels = labels_json(workflow='salmon', env=env, sample=name, outdir=outdir)
 
     if env == 'development':
-        print(f"wdl: {tmp_wf_file}, inputs:{tmp_inputs}, options:{tmp_options}, labels:{tmp_labels}")
+        print(f"wdl: {wdl_wf}, inputs:{indata}, options:{options}, labels:{labels}")
 
-    st = cromwell_api.submit_workflow(wdl_file=tmp_wf_file, inputs=[tmp_inputs], options=tmp_options, labels=tmp_labels, dependency=wdl_zip)
-    print(f"{st['id']}: {st['status']}")
-    del_files( tmp_wf_file, tmp_inputs, tmp_options, tmp_labels)    
+    st = submit(wdl_wf, indata, options, labels, wdl_zip)
+    print(f"{st['id']}: {st['status']}")    
@@ -1,174 +1,430 @@
+import os
 import sys
-from requests import Request, Session, HTTPError
+import time
+import random
+import threading
+from requests import Request, Session, HTTPError, ConnectionError, Timeout, ConnectTimeout
+from requests.adapters import HTTPAdapter
 
 import json
-import kbr.requests_utils as requests_utils
 
-base_url = "localhost:8000"
-protocol = 'http'
+import cromwell.stream as cromwell_stream
+
+# bytes read at a time from streamed responses
+stream_chunk_size = 1024*1024
+
+
+class QueryError(RuntimeError):
+
+    def __init__(self, response:dict):
+        super().__init__(f"Query error: {response.get('status', None)}")
+        self.response = response
+
+
+class RetryPolicy(object):
+
+    def __init__(self, retries:int=3, backoff:float=0.5, max_backoff:float=30, statuses:list=[429, 500, 502, 503, 504]):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def delay(self, attempt:int, response=None) -> float:
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(float(response.headers['Retry-After']), self.max_backoff)
+
+        # exponential backoff with full jitter, so a batch of callers do not retry in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold:int=5, cooldown:float=30, health_check=None, max_probes:int=3):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.health_check = health_check
+        self.max_probes = max_probes
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.probes = 0
+        self.lock = threading.Lock()
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened is None:
+                print(f"Cromwell server is struggling, pausing requests for {self.cooldown}s", file=sys.stderr)
+                self.opened = time.time()
+
+    def wait(self) -> None:
+        ''' blocks while the circuit is open, one caller probes the server health once the cooldown has passed.
+            After max_probes failed probes the server is taken to be down, and callers get a ConnectionError
+            straight away rather than waiting, while a probe is still done every cooldown '''
+        while True:
+            probe = False
+            with self.lock:
+                if self.opened is None:
+                    return
+                remaining = self.opened + self.cooldown - time.time()
+                if remaining <= 0 and not self.probing:
+                    self.probing = True
+                    probe = True
+                elif self.probes >= self.max_probes:
+                    raise ConnectionError("Cromwell server is unavailable")
+
+            if not probe:
+                time.sleep(min(max(remaining, 0.1), 1))
+                continue
 
+            try:
+                healthy = self.health_check is None or self.health_check()
+            except Exception:
+                healthy = False
+
+            with self.lock:
+                self.probing = False
+                if healthy:
+                    self.opened = None
+                    self.failures = 0
+                    self.probes = 0
+                    return
+                self.probes += 1
+                self.opened = time.time()
+
+
+class Client(object):
+
+    def __init__(self, host:str="localhost:8000", protocol:str='http', pool_size:int=10, timeout:float=120,
+                 connect_timeout:float=10, keep_alive:bool=True, retry:RetryPolicy=None, breaker:CircuitBreaker=None):
+        self.base_url = host
+        self.protocol = protocol
+        self.timeout = (connect_timeout, timeout)
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(health_check=self.healthy)
+
+        # one session shared by all calls, so connections (and tls) are reused
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def close(self) -> None:
+        self.session.close()
+
+    def url(self, path:str) -> str:
+        return f"{self.protocol}://{self.base_url}{path}"
+
+    def healthy(self) -> bool:
+        # goes straight to the session, as this is called from within the circuit breaker
+        r = self.session.get(self.url("/engine/v1/status"), timeout=self.timeout)
+        return r.status_code == 200
+
+    def request(self, method:str, path:str, idempotent:bool=True, stream:bool=False, **kwargs) -> dict:
+        ''' non idempotent requests (submits) are only retried if the connection was never made, with stream
+            the response is returned unread '''
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            try:
+                r = self.session.request(method, self.url(path), timeout=self.timeout, stream=stream, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                self.breaker.failure()
+                if attempt >= self.retry.retries or not (idempotent or isinstance(e, ConnectTimeout)):
+                    raise
+                response = None
+            else:
+                if r.status_code not in self.retry.statuses:
+                    self.breaker.success()
+                    r.raise_for_status()
+                    if stream:
+                        return r
+                    return r.json()
+
+                if r.status_code >= 500:
+                    self.breaker.failure()
+                if attempt >= self.retry.retries or not idempotent:
+                    r.raise_for_status()
+                response = r
+                r.close()
+
+            time.sleep(self.retry.delay(attempt, response))
+            attempt += 1
+            for f in (kwargs.get('files', None) or {}).values():
+                if hasattr(f[1], 'seek'):
+                    f[1].seek(0)
+
+    def call(self, wf_id:str, method:str, path:str, **kwargs) -> dict:
+        ''' request that maps http and connection errors to a status dict '''
+        try:
+            return self.request(method, path, **kwargs)
+        except HTTPError as e:
+            return handle_exception(wf_id, e.response.status_code)
+        except (ConnectionError, Timeout):
+            return {'id':wf_id, 'status': 'server unavailable'}
+
+    def get(self, path:str, params:dict=None) -> dict:
+        return self.request('GET', path, params=params)
+
+    def post(self, path:str, data=None, files:dict=None, idempotent:bool=True) -> dict:
+        if files is not None:
+            return self.request('POST', path, idempotent=idempotent, data=data, files=files)
+        return self.request('POST', path, idempotent=idempotent, json=data)
+
+    def patch(self, path:str, data=None) -> dict:
+        return self.request('PATCH', path, json=data)
+
+
+    def get_version(self) -> str:
+        r = self.get("/engine/v1/version")
+        return r.get("cromwell", None)
+
+    def get_status(self) -> str:
+        r = self.get("/engine/v1/status")
+        if r == {}:
+            return "Unknown"
+        return r['serviceName']['ok'], r['serviceName']['messages']
+
+    def submit_workflow(self, wdl_file, inputs:list=[], options=None, dependency=None, labels=None) -> list:
+
+        data = {'version':'v1',
+                }
+
+        files = submit_parts(wdl_file, options, dependency, labels)
 
-def init(host:str="localhost:8000", p='http'):
-    global base_url, protocol
-    base_url = host
-    protocol = p
-    
+        for i, v in enumerate( inputs ):
+            name = 'workflowInputs' if i == 0 else f'workflowInputs_{i+1}'
+            files[name] = part(v, name, 'application/json')
 
+        # a submit is not idempotent, so it is never retried once the request has reached the server
+        return self.call("wf_id", 'POST', "/api/workflows/v1", idempotent=False, data=data, files=files)
 
-#def get_user_history_imports(self, user_id:str) -> []:
-#    return self._request_get(f"{self._base_url}/user/{user_id}/imports")
+    def batch_submit_workflow(self, wdl_file, inputs, options=None, dependency=None, labels=None) -> list:
 
-#def get_history_exports(self, filter:{}={}) -> []:
-#    return self._request_get(f"{self._base_url}/history/exports", data=filter)
+        data = {'version':'v1',
+                }
 
+        files = submit_parts(wdl_file, options, dependency, labels)
+        files['workflowInputs'] = part(inputs, 'workflowInputs', 'application/json')
 
-def handle_exception(wf_id:str, error_code:int) -> dict:
-        if error_code == 400:
-            return {'id':wf_id, 'status': 'malformed id'}
-        if error_code == 403:
-            return {'id':wf_id, 'status': 'in terminal state'}
-        if error_code == 404:
-            return {'id':wf_id, 'status': 'id not found'}
-        if error_code == 405:
-            print("Method now allowed check method/url")
-            sys.exit(1)
-        if error_code == 500:
-            return {'id':wf_id, 'status': 'Internal error'}
+        # a submit is not idempotent, so it is never retried once the request has reached the server
+        return self.call("wf_id", 'POST', "/api/workflows/v1/batch", idempotent=False, data=data, files=files)
 
+    def workflow_status(self, wf_id) -> list:
+        return self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/status")
 
+    def workflows_status(self, wf_id) -> list:
+        return self.call(wf_id, 'GET', "/api/workflows/v1/query")
 
-def get_version() -> str:
-    r, _ = requests_utils.get(f"{protocol}://{base_url}/engine/v1/version")
-    return r.get("cromwell", None)
+    def workflow_abort(self, wf_id) -> list:
+        return self.call(wf_id, 'POST', f"/api/workflows/v1/{wf_id}/abort")
 
+    def workflow_labels_get(self, wf_id) -> list:
+        return self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/labels")
 
-def get_status() -> str:
-    r, _ = requests_utils.get(f"{protocol}://{base_url}/engine/v1/status")
-    if r == {}:
-        return "Unknown"
-    return r['serviceName']['ok'], r['serviceName']['messages']
+    def workflow_labels_set(self, wf_id, data:dict={}) -> list:
+        return self.call(wf_id, 'PATCH', f"/api/workflows/v1/{wf_id}/labels", json=data)
 
+    def workflow_logs(self, wf_id) -> list:
+        return self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/logs")
 
+    def workflow_outputs(self, wf_id) -> list:
+        return self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/outputs")
 
-def submit_workflow(wdl_file:str, inputs:list=[], options:str=None, dependency:str=None, labels:str=None) ->list:
+    def workflow_meta(self, wf_id, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> list:
+        params = meta_params(include_keys, exclude_keys, expand_subworkflows)
+        return self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/metadata", params=params)
 
-    data = {'version':'v1',
-            }
+    def workflow_meta_stream(self, wf_id, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False, tee=None):
+        ''' workflow_meta as ('field', key, value) and ('shard', call, shard) events, see cromwell.stream.
+            The raw response is also written to tee if given '''
+        params = meta_params(include_keys, exclude_keys, expand_subworkflows)
+        try:
+            r = self.request('GET', f"/api/workflows/v1/{wf_id}/metadata", params=params, stream=True)
+        except HTTPError as e:
+            e.response.close()
+            st = handle_exception(wf_id, e.response.status_code)
+        except (ConnectionError, Timeout):
+            st = {'id':wf_id, 'status': 'server unavailable'}
+        else:
+            with r:
+                yield from cromwell_stream.events(tee_chunks(r.iter_content(chunk_size=stream_chunk_size), tee))
+            return
 
-    files = {'workflowSource': (wdl_file, open(wdl_file, 'rb'), 'application/octet-stream')}
+        for key, value in st.items():
+            yield 'field', key, value
 
-    if inputs != []:
-        files[f'workflowInputs'] = (inputs[0], open(inputs[0], 'rb'), 'application/json')
-        for i, v in enumerate( inputs ):
-            if i == 0:
-                continue
-            files[f'workflowInputs_{i+1}'] = (v, open(v, 'rb'), 'application/json')
+    def workflows(self, data={}) -> list:
+        return self.call("na", 'POST', "/api/workflows/v1/query", json=data)
 
-    if options is not None:
-        files['workflowOptions'] = (options, open(options, 'rb'), 'application/json')
+    def workflows_iter(self, data={}, page_size:int=1000):
+        ''' query that pages through the results, rows are yielded as each page arrives '''
+        if isinstance(data, dict):
+            data = [data] if data != {} else []
 
-    if dependency is not None:
-        files['workflowDependencies'] = (dependency, open(dependency, 'rb'), 'application/zip')
+        page = 1
+        seen = 0
+        while True:
+            r = self.workflows(data + [{'page': str(page)}, {'pageSize': str(page_size)}])
+            if 'results' not in r:
+                raise QueryError(r)
 
-    if labels is not None:
-        files['labels'] = (labels, open(labels, 'rb'), 'application/json')
+            for row in r['results']:
+                yield row
+
+            seen += len(r['results'])
+            if len(r['results']) < page_size or seen >= r.get('totalResultsCount', seen + 1):
+                break
+            page += 1
+
+
+def part(value, name:str, content_type:str) -> tuple:
+    ''' a multipart submission part. value is a filename, the content as str/bytes, or a dict/list sent as json '''
+
+    if isinstance(value, (dict, list)):
+        return (f"{name}.json", json.dumps(value).encode(), content_type)
 
-    try:
-        r, _ = requests_utils.post(f"{protocol}://{base_url}/api/workflows/v1", data=data, files=files)
-        return r
-    except HTTPError as e:
-        return handle_exception("wf_id", e.response.status_code)
+    if isinstance(value, bytes):
+        return (name, value, content_type)
 
+    if os.path.isfile(value):
+        with open(value, 'rb') as fh:
+            return (value, fh.read(), content_type)
 
-def batch_submit_workflow(wdl_file:str, inputs:str, options:str=None, dependency:str=None, labels:str=None) -> list:
+    return (name, value.encode(), content_type)
 
-    data = {'version':'v1',
-            'workflowSource': wdl_file,
-            'workflowInputs': inputs}
 
-    files = {'workflowSource': (wdl_file, open(wdl_file, 'rb'), 'application/octet-stream'),
-             'workflowInputs': (inputs,   open(inputs, 'rb'),'application/json')}
+def submit_parts(wdl_file, options=None, dependency=None, labels=None) -> dict:
+
+    files = {'workflowSource': part(wdl_file, 'workflowSource', 'application/octet-stream')}
 
     if options is not None:
-        files['workflowOptions'] = (options, open(options, 'rb'), 'application/json')
+        files['workflowOptions'] = part(options, 'workflowOptions', 'application/json')
 
     if dependency is not None:
-        files['workflowDependencies'] = (dependency, open(dependency, 'rb'), 'application/zip')
+        files['workflowDependencies'] = part(dependency, 'workflowDependencies', 'application/zip')
 
     if labels is not None:
-        files['labels'] = (labels, open(labels, 'rb'), 'application/json')
+        files['labels'] = part(labels, 'labels', 'application/json')
+
+    return files
+
+
+def meta_params(include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> list:
+    ''' query parameters for the metadata endpoint, keys match any (nested) metadata key with that prefix '''
+    params = []
+    for key in include_keys or []:
+        params.append(('includeKey', key))
+    for key in exclude_keys or []:
+        params.append(('excludeKey', key))
+    if expand_subworkflows:
+        params.append(('expandSubWorkflows', 'true'))
+
+    return params
 
-    try:
-        r, _ = requests_utils.post(f"{protocol}://{base_url}/api/workflows/v1/batch", data=data, files=files)
-        return r
-    except HTTPError as e:
-        return handle_exception("wf_id", e.response.status_code)
+
+def tee_chunks(chunks, tee=None):
+    for chunk in chunks:
+        if tee is not None:
+            tee.write(chunk)
+        yield chunk
+
+
+client = Client()
+
+
+def init(host:str="localhost:8000", p='http', pool_size:int=10, timeout:float=120, connect_timeout:float=10,
+         keep_alive:bool=True, retry:RetryPolicy=None, breaker:CircuitBreaker=None) -> Client:
+    global client
+    client.close()
+    client = Client(host, p, pool_size=pool_size, timeout=timeout, connect_timeout=connect_timeout, keep_alive=keep_alive,
+                    retry=retry, breaker=breaker)
+    return client
+    
+
+
+#def get_user_history_imports(self, user_id:str) -> []:
+#    return self._request_get(f"{self._base_url}/user/{user_id}/imports")
+
+#def get_history_exports(self, filter:{}={}) -> []:
+#    return self._request_get(f"{self._base_url}/history/exports", data=filter)
+
+
+def handle_exception(wf_id:str, error_code:int) -> dict:
+        if error_code == 400:
+            return {'id':wf_id, 'status': 'malformed id'}
+        if error_code == 403:
+            return {'id':wf_id, 'status': 'in terminal state'}
+        if error_code == 404:
+            return {'id':wf_id, 'status': 'id not found'}
+        if error_code == 405:
+            return {'id':wf_id, 'status': 'method not allowed'}
+        if error_code == 500:
+            return {'id':wf_id, 'status': 'Internal error'}
+        if error_code in [429, 502, 503, 504]:
+            return {'id':wf_id, 'status': 'server unavailable'}
+
+        return {'id':wf_id, 'status': f'http error {error_code}'}
+
+
+
+def get_version() -> str:
+    return client.get_version()
+
+
+def get_status() -> str:
+    return client.get_status()
+
+
+def submit_workflow(wdl_file, inputs:list=[], options=None, dependency=None, labels=None) ->list:
+    return client.submit_workflow(wdl_file, inputs, options, dependency, labels)
+
+
+def batch_submit_workflow(wdl_file, inputs, options=None, dependency=None, labels=None) -> list:
+    return client.batch_submit_workflow(wdl_file, inputs, options, dependency, labels)
 
 
 def workflow_status(wf_id) -> list:
-    try:
-        r, _ = requests_utils.get(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/status")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflow_status(wf_id)
 
 
 def workflows_status(wf_id) -> list:
-    try:
-        r, _ = requests_utils.get(f"{protocol}://{base_url}/api/workflows/v1/query")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflows_status(wf_id)
 
 
 def workflow_abort(wf_id) -> list:
-    try:
-        r, _ = requests_utils.post(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/abort")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflow_abort(wf_id)
 
 
 def workflow_labels_get(wf_id) -> list:
-    try:
-        r, _ = requests_utils.get(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/labels")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflow_labels_get(wf_id)
 
 def workflow_labels_set(wf_id, data:dict={}) -> list:
-    try:
-        r, _ = requests_utils.patch(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/labels", data=data)
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflow_labels_set(wf_id, data)
 
 
 def workflow_logs(wf_id) -> list:
-    try:
-        r, _ = requests_utils.get(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/logs")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflow_logs(wf_id)
 
 def workflow_outputs(wf_id) -> list:
-    try:
-        r, _ = requests_utils.get(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/outputs")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+    return client.workflow_outputs(wf_id)
+
+def workflow_meta(wf_id, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> list:
+    return client.workflow_meta(wf_id, include_keys, exclude_keys, expand_subworkflows)
 
-def workflow_meta(wf_id) -> list:
-    try:
-        r, _ = requests_utils.get(f"{protocol}://{base_url}/api/workflows/v1/{wf_id}/metadata")
-        return r
-    except HTTPError as e:
-        return handle_exception(wf_id, e.response.status_code)
+def workflow_meta_stream(wf_id, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False, tee=None):
+    return client.workflow_meta_stream(wf_id, include_keys, exclude_keys, expand_subworkflows, tee)
 
 
 def workflows(data={}) -> list:
-    try:
-        r, _ = requests_utils.post(f"{protocol}://{base_url}/api/workflows/v1/query", data=data)
-        return r
-    except HTTPError as e:
-        return handle_exception("na", e.response.status_code)
+    return client.workflows(data)
+
+
+def workflows_iter(data={}, page_size:int=1000):
+    return client.workflows_iter(data, page_size)
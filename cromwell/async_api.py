@@ -0,0 +1,142 @@
+import asyncio
+
+import aiohttp
+
+import cromwell.api as cromwell_api
+from cromwell.api import handle_exception, meta_params, part, submit_parts, RetryPolicy
+
+
+class AsyncClient(object):
+
+    def __init__(self, host:str="localhost:8000", protocol:str='http', concurrency:int=20, timeout:float=120,
+                 connect_timeout:float=10, keep_alive:bool=True, retry:RetryPolicy=None):
+        self.base_url = host
+        self.protocol = protocol
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.keep_alive = keep_alive
+        self.retry = retry or RetryPolicy()
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        # the session and semaphore have to be created inside the running loop
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, force_close=not self.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def url(self, path:str) -> str:
+        return f"{self.protocol}://{self.base_url}{path}"
+
+    async def request(self, method:str, path:str, idempotent:bool=True, **kwargs) -> dict:
+        ''' same retry rules as the sync client, except that submits are never retried as form data is single use '''
+        await self.open()
+        attempt = 0
+        while True:
+            response = None
+            try:
+                async with self.semaphore:
+                    async with self.session.request(method, self.url(path), **kwargs) as r:
+                        if r.status not in self.retry.statuses or attempt >= self.retry.retries or not idempotent:
+                            r.raise_for_status()
+                            return await r.json(content_type=None)
+                        response = r
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.retry.retries or not idempotent:
+                    raise
+
+            await asyncio.sleep(self.retry.delay(attempt, response))
+            attempt += 1
+
+    async def get(self, path:str, params:dict=None) -> dict:
+        return await self.request('GET', path, params=params)
+
+    async def post(self, path:str, data=None, form:aiohttp.FormData=None) -> dict:
+        if form is not None:
+            return await self.request('POST', path, data=form)
+        return await self.request('POST', path, json=data)
+
+    async def patch(self, path:str, data=None) -> dict:
+        return await self.request('PATCH', path, json=data)
+
+    async def call(self, wf_id:str, method:str, path:str, **kwargs) -> dict:
+        try:
+            return await self.request(method, path, **kwargs)
+        except aiohttp.ClientResponseError as e:
+            return handle_exception(wf_id, e.status)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            return {'id':wf_id, 'status': 'server unavailable'}
+
+
+    async def get_version(self) -> str:
+        r = await self.get("/engine/v1/version")
+        return r.get("cromwell", None)
+
+    async def submit_workflow(self, wdl_file, inputs:list=[], options=None, dependency=None, labels=None) -> dict:
+
+        files = submit_parts(wdl_file, options, dependency, labels)
+        for i, v in enumerate( inputs ):
+            name = 'workflowInputs' if i == 0 else f'workflowInputs_{i+1}'
+            files[name] = part(v, name, 'application/json')
+
+        form = aiohttp.FormData()
+        form.add_field('version', 'v1')
+        for name, (filename, content, content_type) in files.items():
+            form.add_field(name, content, filename=filename, content_type=content_type)
+
+        return await self.call("wf_id", 'POST', "/api/workflows/v1", idempotent=False, data=form)
+
+    async def workflow_status(self, wf_id) -> dict:
+        return await self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/status")
+
+    async def workflow_abort(self, wf_id) -> dict:
+        return await self.call(wf_id, 'POST', f"/api/workflows/v1/{wf_id}/abort")
+
+    async def workflow_labels_get(self, wf_id) -> dict:
+        return await self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/labels")
+
+    async def workflow_labels_set(self, wf_id, data:dict={}) -> dict:
+        return await self.call(wf_id, 'PATCH', f"/api/workflows/v1/{wf_id}/labels", json=data)
+
+    async def workflow_logs(self, wf_id) -> dict:
+        return await self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/logs")
+
+    async def workflow_outputs(self, wf_id) -> dict:
+        return await self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/outputs")
+
+    async def workflow_meta(self, wf_id, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> dict:
+        params = meta_params(include_keys, exclude_keys, expand_subworkflows)
+        return await self.call(wf_id, 'GET', f"/api/workflows/v1/{wf_id}/metadata", params=params)
+
+    async def workflows(self, data={}) -> dict:
+        return await self.call("na", 'POST', "/api/workflows/v1/query", json=data)
+
+    async def map(self, method:str, wf_ids:list, **kwargs) -> list:
+        ''' runs a per-id call for all ids, results are in the same order as the ids '''
+        func = getattr(self, method)
+        return await asyncio.gather(*[func(wf_id, **kwargs) for wf_id in wf_ids])
+
+
+def run(method:str, wf_ids:list, host:str=None, protocol:str=None, concurrency:int=20, **kwargs) -> list:
+    # default to the server the sync api has been initialised against
+    host = host or cromwell_api.client.base_url
+    protocol = protocol or cromwell_api.client.protocol
+
+    async def _run():
+        async with AsyncClient(host, protocol, concurrency=concurrency) as client:
+            return await client.map(method, wf_ids, **kwargs)
+
+    return asyncio.run(_run())
@@ -0,0 +1,189 @@
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+
+import cromwell.api as cromwell_api
+import cromwell.stream as cromwell_stream
+
+
+terminal_states = ['Succeeded', 'Failed', 'Aborted']
+workflow_states = ['Submitted', 'On Hold', 'Running', 'Aborting'] + terminal_states
+
+cache_dir = os.environ.get('CROMWELL_CACHE', os.path.expanduser('~/.cache/cromwell-utils'))
+max_size  = 2*1024*1024*1024
+enabled   = True
+
+
+def init(path:str=None, size:int=None, enable:bool=True) -> None:
+    global cache_dir, max_size, enabled
+    if path is not None:
+        cache_dir = path
+    if size is not None:
+        max_size = size
+    enabled = enable
+
+
+def _filename(wf_id:str, kind:str) -> str:
+    return os.path.join(cache_dir, f"{wf_id}.{kind}.json.gz")
+
+
+def _kind(include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> str:
+    # different projections of the same workflow are cached separately
+    if include_keys is None and exclude_keys is None and not expand_subworkflows:
+        return 'meta'
+
+    key = json.dumps([sorted(include_keys or []), sorted(exclude_keys or []), expand_subworkflows])
+    return f"meta-{hashlib.md5(key.encode()).hexdigest()[:12]}"
+
+
+def get(wf_id:str, kind:str) -> dict:
+    filename = _filename(wf_id, kind)
+    try:
+        with gzip.open(filename, 'rt') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+    # bump the mtime, eviction removes the least recently used files first
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+
+    return data
+
+
+def put(wf_id:str, kind:str, data:dict) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # write to a tmpfile and rename so concurrent readers never see a partial file
+    fd, tmpfile = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with gzip.open(os.fdopen(fd, 'wb'), 'wt') as fh:
+        json.dump(data, fh)
+    os.replace(tmpfile, _filename(wf_id, kind))
+
+    evict()
+
+
+def delete(wf_id:str, kind:str) -> None:
+    try:
+        os.remove(_filename(wf_id, kind))
+    except OSError:
+        pass
+
+
+def evict(size:int=None) -> None:
+    size = max_size if size is None else size
+
+    entries = []
+    total = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.json.gz'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    except FileNotFoundError:
+        return
+
+    if total <= size:
+        return
+
+    for _, file_size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= file_size
+        if total <= size:
+            break
+
+
+def clear() -> None:
+    evict(size=0)
+
+
+def workflow_meta(wf_id:str, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> dict:
+    ''' api.workflow_meta, but terminal workflows are served from/stored in the cache '''
+
+    if include_keys is not None and 'status' not in include_keys:
+        include_keys = include_keys + ['status']
+
+    kind = _kind(include_keys, exclude_keys, expand_subworkflows)
+    if enabled:
+        data = get(wf_id, kind)
+        if data is not None:
+            return data
+
+    data = cromwell_api.workflow_meta(wf_id, include_keys, exclude_keys, expand_subworkflows)
+
+    if enabled and data.get('status', None) in terminal_states:
+        put(wf_id, kind, data)
+
+    return data
+
+
+def workflow_meta_stream(wf_id:str, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False):
+    ''' api.workflow_meta_stream, served from the cache for terminal workflows. The response is written to the
+        cache as it is streamed and kept if the workflow turns out to be terminal '''
+
+    if include_keys is not None and 'status' not in include_keys:
+        include_keys = include_keys + ['status']
+
+    kind = _kind(include_keys, exclude_keys, expand_subworkflows)
+    if not enabled:
+        yield from cromwell_api.workflow_meta_stream(wf_id, include_keys, exclude_keys, expand_subworkflows)
+        return
+
+    filename = _filename(wf_id, kind)
+    try:
+        fh = gzip.open(filename, 'rb')
+    except OSError:
+        fh = None
+
+    if fh is not None:
+        with fh:
+            try:
+                os.utime(filename)
+            except OSError:
+                pass
+            yield from cromwell_stream.events(cromwell_stream.file_chunks(fh))
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmpfile = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    status = None
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as tee:
+            for event in cromwell_api.workflow_meta_stream(wf_id, include_keys, exclude_keys, expand_subworkflows, tee=tee):
+                if event[0] == 'field' and event[1] == 'status':
+                    status = event[2]
+                yield event
+    except BaseException:
+        # includes the consumer stopping early, the document is then incomplete
+        os.remove(tmpfile)
+        raise
+
+    if status in terminal_states:
+        os.replace(tmpfile, filename)
+        evict()
+    else:
+        os.remove(tmpfile)
+
+
+def workflow_outputs(wf_id:str) -> dict:
+    ''' outputs for a workflow, as returned by api.workflow_outputs '''
+
+    # the outputs are taken from the metadata, as that also tells if the workflow is done and can be cached
+    data = workflow_meta(wf_id, include_keys=['outputs'])
+    if 'outputs' not in data and data.get('status', None) not in workflow_states:
+        return data
+
+    return {'id': wf_id, 'outputs': data.get('outputs', {})}
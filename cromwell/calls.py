@@ -0,0 +1,169 @@
+from array import array
+from datetime import datetime
+
+import cromwell.cache as cromwell_cache
+
+
+class Categories(object):
+    ''' a column of few distinct values (call names, states), each row only stores an int code '''
+    __slots__ = ['values', 'index', 'codes']
+
+    def __init__(self):
+        self.values = []
+        self.index  = {}
+        self.codes  = array('i')
+
+    def append(self, value) -> None:
+        code = self.index.get(value, None)
+        if code is None:
+            code = len(self.values)
+            self.index[ value ] = code
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, row:int):
+        return self.values[ self.codes[row] ]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def match(self, values:list, rows) -> list:
+        codes = set(self.index[v] for v in values if v in self.index)
+        return [row for row in rows if self.codes[row] in codes]
+
+
+class CallTable(object):
+    ''' the shards of a workflow as columns, rows are selected and grouped through lists of row numbers '''
+    __slots__ = ['fields', 'parent', 'call', 'shard', 'attempt', 'status', 'backend_status', 'root', 'start', 'end',
+                 'run_start', 'run_end', 'backend', 'cache_hit', 'rc']
+
+    columns = ['parent', 'call', 'shard', 'attempt', 'status', 'backend_status', 'root', 'start', 'end', 'run_start',
+               'run_end', 'backend', 'cache_hit', 'rc']
+
+    def __init__(self):
+        self.fields         = {}
+        self.parent         = Categories()
+        self.call           = Categories()
+        self.shard          = array('i')
+        self.attempt        = array('i')
+        self.status         = Categories()
+        self.backend_status = Categories()
+        self.root           = []
+        self.start          = []
+        self.end            = []
+        self.run_start      = []
+        self.run_end        = []
+        self.backend        = Categories()
+        self.cache_hit      = Categories()
+        self.rc             = Categories()
+
+    def __len__(self) -> int:
+        return len(self.call)
+
+    def append(self, call:str, shard:dict, parent:str='') -> None:
+        # expanded subworkflows are flattened, the parent column has the call:shard (nested ones joined by /) of the
+        # subworkflow they ran in, so the shards of a scattered subworkflow stay apart
+        if 'subWorkflowMetadata' in shard:
+            shard_index = shard.get('shardIndex', None)
+            name = call if shard_index is None or shard_index < 0 else f"{call}:{shard_index}"
+            name = f"{parent}/{name}" if parent else name
+            for sub_call, sub_shards in shard['subWorkflowMetadata'].get('calls', {}).items():
+                for sub_shard in sub_shards:
+                    self.append(sub_call, sub_shard, name)
+            return
+
+        run_start, run_end = None, None
+        for event in shard.get('executionEvents', None) or []:
+            if event.get('description', None) == 'RunningJob':
+                run_start, run_end = event.get('startTime', None), event.get('endTime', None)
+
+        shard_index = shard.get('shardIndex', None)
+        attempt = shard.get('attempt', None)
+
+        self.parent.append(parent)
+        self.call.append(call)
+        self.shard.append(-1 if shard_index is None else shard_index)
+        self.attempt.append(1 if attempt is None else attempt)
+        self.status.append(shard.get('executionStatus', None))
+        self.backend_status.append(shard.get('backendStatus', None))
+        self.root.append(shard.get('callRoot', None))
+        self.start.append(shard.get('start', None))
+        self.end.append(shard.get('end', None))
+        self.run_start.append(run_start)
+        self.run_end.append(run_end)
+        self.backend.append(shard.get('backend', None))
+        self.cache_hit.append((shard.get('callCaching', None) or {}).get('hit', None))
+        self.rc.append(shard.get('returnCode', None))
+
+    def all(self) -> range:
+        return range(len(self))
+
+    def shard_id(self, row:int) -> tuple:
+        ''' (parent, shard), unique for the shards of a call across the instances of the subworkflows it is in '''
+        return (self.parent[row], self.shard[row])
+
+    def value(self, column:str, row:int):
+        return getattr(self, column)[row]
+
+    def column(self, column:str, rows=None) -> list:
+        values = getattr(self, column)
+        return [values[row] for row in (self.all() if rows is None else rows)]
+
+    def select(self, rows=None, **filters) -> list:
+        ''' rows where every column has (one of) the given value(s), eg: select(call='wf.align', status=['Failed', 'Running']) '''
+        rows = self.all() if rows is None else rows
+        for column, values in filters.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            data = getattr(self, column)
+            if isinstance(data, Categories):
+                rows = data.match(values, rows)
+            else:
+                values = set(values)
+                rows = [row for row in rows if data[row] in values]
+
+        return list(rows)
+
+    def reject(self, rows=None, **filters) -> list:
+        ''' rows not matching all the filters '''
+        rows = self.all() if rows is None else rows
+        matches = set(self.select(rows, **filters))
+        return [row for row in rows if row not in matches]
+
+    def group_by(self, column:str, rows=None) -> dict:
+        ''' value -> rows '''
+        groups = {}
+        values = getattr(self, column)
+        for row in (self.all() if rows is None else rows):
+            groups.setdefault(values[row], []).append(row)
+
+        return groups
+
+    def count_by(self, column:str, rows=None) -> dict:
+        return {value: len(rows) for value, rows in self.group_by(column, rows).items()}
+
+    def rows(self, rows=None, columns:list=None):
+        ''' the rows as dicts, for printing/json '''
+        columns = columns or self.columns
+        for row in (self.all() if rows is None else rows):
+            yield {column: getattr(self, column)[row] for column in columns}
+
+
+def timestamp(value:str) -> float:
+    ''' seconds since the epoch for a cromwell timestamp, None if not set '''
+    if value is None:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def call_table(wf_id:str, include_keys:list=None, exclude_keys:list=None, expand_subworkflows:bool=False) -> CallTable:
+    ''' builds the table from the streamed (cached) metadata, the top level fields are kept in table.fields '''
+
+    table = CallTable()
+    for event, key, value in cromwell_cache.workflow_meta_stream(wf_id, include_keys, exclude_keys, expand_subworkflows):
+        if event == 'shard':
+            table.append(key, value)
+        else:
+            table.fields[ key ] = value
+
+    return table
@@ -0,0 +1,114 @@
+import os
+import stat
+
+
+def human_size(size:int) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(size) < 1024 or unit == 'TB':
+            break
+        size /= 1024
+
+    if unit == 'B':
+        return f"{size}{unit}"
+    return f"{size:.1f}{unit}"
+
+
+def walk(root_dir:str, prune:set=frozenset()):
+    ''' yields (path, name, stat) for every file under root_dir, skipping the dirs in prune. Symlinks are not followed
+        and directories are read with scandir so only a single lstat is done per file '''
+
+    stack = [root_dir]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+
+        with it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    if entry.path not in prune:
+                        stack.append(entry.path)
+                else:
+                    yield entry.path, entry.name, st
+
+
+def reclaimable(st:os.stat_result, links:dict) -> int:
+    ''' bytes freed by deleting a file, a hardlinked file only frees space once all its links seen in links are deleted '''
+    if stat.S_ISLNK(st.st_mode):
+        return 0
+
+    if st.st_nlink > 1:
+        key = (st.st_dev, st.st_ino)
+        links[key] = links.get(key, 0) + 1
+        if links[key] < st.st_nlink:
+            return 0
+
+    return st.st_blocks * 512
+
+
+def delete_files(root_dir:str, keep_names:set=frozenset(), keep_paths:set=frozenset(), dry_run:bool=False,
+                 prune:set=frozenset()) -> dict:
+    ''' deletes the files under root_dir not named in keep_names or keep_paths and not in a dir in prune, returns the
+        number of files and bytes that were (or with dry_run would be) deleted '''
+
+    res = {'files': 0, 'bytes': 0}
+    if root_dir is None:
+        return res
+
+    links = {}
+
+    for path, name, st in walk(root_dir, prune):
+        if name in keep_names or path in keep_paths:
+            continue
+
+        if not dry_run:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+
+        res['files'] += 1
+        res['bytes'] += reclaimable(st, links)
+
+    return res
+
+
+def usage(root_dir:str) -> dict:
+    ''' du for a directory tree: number of files, bytes used on disk and apparent size. Hardlinks are counted once '''
+
+    res = {'files': 0, 'bytes': 0, 'size': 0}
+    if root_dir is None:
+        return res
+
+    seen = set()
+    for _, _, st in walk(root_dir):
+        if st.st_nlink > 1:
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+
+        res['files'] += 1
+        res['bytes'] += st.st_blocks * 512
+        res['size']  += st.st_size
+
+    return res
+
+
+def outermost(root_dirs:list) -> set:
+    ''' the dirs that are not inside one of the other dirs, eg: retries live in an attempt-N dir in the call dir '''
+
+    roots = set(d.rstrip('/') for d in root_dirs if d is not None)
+    res = set()
+    for root_dir in roots:
+        parent = os.path.dirname(root_dir)
+        while parent not in roots and parent != os.path.dirname(parent):
+            parent = os.path.dirname(parent)
+        if parent not in roots:
+            res.add(root_dir)
+
+    return res
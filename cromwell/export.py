@@ -0,0 +1,399 @@
+import os
+import re
+import json
+import mmap
+import zlib
+import errno
+import fcntl
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cromwell.api as cromwell_api
+import cromwell.cache as cromwell_cache
+
+
+# move: rename on the same filesystem, copy + delete otherwise
+# link: hardlink/reflink on the same filesystem, copy otherwise, the cromwell files are left in place
+# copy: always copy
+modes = ['move', 'link', 'copy']
+
+manifest_name = '.cromwell-export.json'
+# a line per exported file is appended here during an export, and merged into the manifest at the end
+journal_name  = '.cromwell-export.journal'
+chunk_size    = 16*1024*1024
+
+# linux ioctl to clone a file on filesystems with copy-on-write support (btrfs, xfs)
+FICLONE = 0x40049409
+
+_manifest_lock = threading.Lock()
+_dst_locks = {}
+
+
+def manifest_file(outdir:str) -> str:
+    return os.path.join(outdir, manifest_name)
+
+
+def journal_file(outdir:str) -> str:
+    return os.path.join(outdir, journal_name)
+
+
+def load_manifest(outdir:str) -> dict:
+    ''' the manifest with the files journaled by an export that did not finish '''
+    try:
+        with open(manifest_file(outdir)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = {}
+
+    try:
+        with open(journal_file(outdir)) as fh:
+            for line in fh:
+                try:
+                    wf_id, dst, entry = json.loads(line)
+                except ValueError:
+                    # blank, or cut short by the interruption
+                    continue
+                manifest.setdefault(wf_id, {'files': {}})['files'][dst] = entry
+    except OSError:
+        pass
+
+    return manifest
+
+
+def save_manifest(outdir:str, manifest:dict) -> None:
+    os.makedirs(outdir, exist_ok=True)
+    tmpfile = f"{manifest_file(outdir)}.tmp"
+    with open(tmpfile, 'w') as fh:
+        json.dump(manifest, fh)
+    os.replace(tmpfile, manifest_file(outdir))
+
+    # everything journaled is in the manifest now
+    try:
+        os.remove(journal_file(outdir))
+    except OSError:
+        pass
+
+
+def journal(outdir:str, wf_id:str, dst:str, entry:dict) -> None:
+    ''' records an exported file with a single appended line rather than rewriting the whole manifest '''
+    with open(journal_file(outdir), 'a') as fh:
+        # leading newline, so a line cut short by an interrupted run is never joined with the next one
+        fh.write("\n" + json.dumps([wf_id, dst, entry]))
+
+
+def output_files(outputs:dict) -> list:
+    files = []
+    for value in outputs.values():
+        if not isinstance(value, list):
+            value = [value]
+        files += [v for v in value if isinstance(v, str)]
+
+    return files
+
+
+def destination(outdir:str, filename:str, wf_id:str=None) -> str:
+    ''' the file name without the execution dirs, with wf_id the call/shard dirs below the workflow dir are kept '''
+    if wf_id is not None and f"/{wf_id}/" in filename:
+        outfile = filename.split(f"/{wf_id}/", 1)[1].replace('/execution/', '/')
+    else:
+        outfile = re.sub(r'.*\/execution/', '', filename)
+    outfile = re.sub(r'^./', '', outfile)
+    return os.path.join(outdir, outfile)
+
+
+def copy(src:str, dst:str, verify:bool=False) -> str:
+    ''' chunked copy, returns the md5 of the source if verify is set, raises if the copy does not match it '''
+
+    md5 = hashlib.md5() if verify else None
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            if md5 is not None:
+                md5.update(chunk)
+            fout.write(chunk)
+
+    if md5 is None:
+        return None
+
+    check = hashlib.md5()
+    with open(dst, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            check.update(chunk)
+
+    if check.hexdigest() != md5.hexdigest():
+        raise OSError(errno.EIO, f"checksum mismatch after copying {src} to {dst}")
+
+    return md5.hexdigest()
+
+
+def checksum(filename:str) -> dict:
+    ''' md5 and crc32 of a file in a single mmap'ed pass, with the size and mtime they belong to '''
+
+    md5 = hashlib.md5()
+    crc = 0
+    with open(filename, 'rb') as fh:
+        st = os.fstat(fh.fileno())
+        if st.st_size > 0:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, st.st_size, chunk_size):
+                        chunk = view[offset:offset+chunk_size]
+                        md5.update(chunk)
+                        crc = zlib.crc32(chunk, crc)
+                finally:
+                    chunk = None
+                    view.release()
+
+    return {'size': st.st_size, 'mtime': st.st_mtime, 'md5': md5.hexdigest(), 'crc32': f"{crc:08x}"}
+
+
+def reflink(src:str, dst:str) -> None:
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError:
+            fout.close()
+            os.unlink(dst)
+            raise
+
+
+def transfer(src:str, dst:str, mode:str='move', verify:bool=False) -> str:
+    ''' gets src to dst as cheaply as the filesystems allow, returns how it was done '''
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    same_fs = os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev
+
+    # tmp name + rename, so an interrupted transfer never leaves a partial file under the real name
+    tmpfile = f"{dst}.part"
+
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, f"{dst} already exists")
+
+    # link + unlink rather than rename for a move, os.link fails instead of replacing a file that appeared meanwhile
+    if same_fs and mode in ['move', 'link']:
+        try:
+            os.link(src, dst)
+            if mode == 'move':
+                os.unlink(src)
+                return 'rename'
+            return 'hardlink'
+        except FileExistsError:
+            raise
+        except OSError:
+            pass
+
+    if same_fs and mode == 'link':
+        try:
+            reflink(src, tmpfile)
+            os.replace(tmpfile, dst)
+            return 'reflink'
+        except OSError:
+            pass
+
+    copy(src, tmpfile, verify=verify)
+    st = os.stat(src)
+    os.utime(tmpfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmpfile, dst)
+
+    if mode == 'move':
+        os.unlink(src)
+
+    return 'copy'
+
+
+def plan_workflow(wf_id:str, outdir:str=None) -> dict:
+    ''' the files a workflow exports and where they go, files with the same name (eg: scattered outputs) keep their
+        call/shard dirs so they do not overwrite each other '''
+
+    meta = cromwell_cache.workflow_meta(wf_id, include_keys=['outputs'])
+    status = meta.get('status', None)
+    if status != 'Succeeded':
+        return {'id': wf_id, 'status': status, 'files': []}
+
+    if outdir is None:
+        labels = cromwell_api.workflow_labels_get(wf_id).get('labels', {})
+        if 'outdir' in labels:
+            outdir = labels['outdir']
+        else:
+            outdir = os.getcwd()
+
+    srcs = sorted(set(output_files(meta.get('outputs', {}))))
+    names = {}
+    for src in srcs:
+        names.setdefault(destination(outdir, src), []).append(src)
+
+    files = []
+    for src in srcs:
+        dst = destination(outdir, src)
+        if len(names[dst]) > 1:
+            dst = destination(outdir, src, wf_id)
+        files.append((src, dst))
+
+    return {'id': wf_id, 'status': status, 'outdir': outdir, 'files': files}
+
+
+def export_file(wf_id:str, src:str, dst:str, outdir:str, manifests:dict, mode:str, verify:bool, checksums:bool=False) -> bool:
+
+    with _manifest_lock:
+        lock = _dst_locks.setdefault(dst, threading.Lock())
+
+    # the check and the transfer are done under the lock, so two workers can never both find dst missing
+    with lock:
+        return _export_file(wf_id, src, dst, outdir, manifests, mode, verify, checksums)
+
+
+def _export_file(wf_id:str, src:str, dst:str, outdir:str, manifests:dict, mode:str, verify:bool, checksums:bool) -> bool:
+
+    manifest = manifests[outdir]
+    with _manifest_lock:
+        entry = manifest.get(wf_id, {}).get('files', {}).get(dst, None)
+
+    if entry is not None and entry.get('src', None) == src and os.path.isfile(dst) and os.path.getsize(dst) == entry['size']:
+        if not checksums or 'md5' in entry:
+            return True
+        # exported by an earlier run without checksums
+        how = entry['how']
+    elif os.path.isfile(dst):
+        if not os.path.isfile(src) or os.path.getsize(src) == os.path.getsize(dst):
+            print(f"{dst} is already present and files have the same size")
+            how = 'present'
+        else:
+            print(f"{dst} is already present and files have different sizes")
+            return False
+    elif not os.path.isfile(src):
+        print(f"{src} no longer on disk...")
+        return False
+    else:
+        try:
+            how = transfer(src, dst, mode=mode, verify=verify)
+        except OSError as e:
+            print(f"Could not export {src}: {e}")
+            return False
+        print(f"{how}: {src} --> {dst}")
+
+    # hashed by the worker that exported the file, so the checksums are done in parallel with the other transfers
+    if checksums:
+        entry = checksum(dst)
+    else:
+        st = os.stat(dst)
+        entry = {'size': st.st_size, 'mtime': st.st_mtime}
+    entry.update({'src': src, 'how': how})
+
+    with _manifest_lock:
+        manifest.setdefault(wf_id, {'files': {}})['files'][dst] = entry
+        journal(outdir, wf_id, dst, entry)
+
+    return True
+
+
+def export(wf_ids:list, outdir:str=None, mode:str='move', verify:bool=False, checksums:bool=False, jobs:int=8) -> dict:
+    ''' exports the outputs of the workflows, the files are transferred in parallel and the progress is kept in
+        a manifest in the outdir, so an interrupted export can be rerun. Returns wf_id -> True if all files were exported '''
+
+    if mode not in modes:
+        raise RuntimeError(f"{mode} is an unknown export mode, allowed: {', '.join(modes)}")
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        plans = list(executor.map(lambda wf_id: plan_workflow(wf_id, outdir), wf_ids))
+
+        manifests = {}
+        tasks = []
+        for plan in plans:
+            if plan['status'] != 'Succeeded':
+                print(f"Cannot export output files for {plan['id']} as status is {plan['status']}")
+                continue
+            if plan['outdir'] not in manifests:
+                manifests[plan['outdir']] = load_manifest(plan['outdir'])
+            for src, dst in plan['files']:
+                tasks.append((plan['id'], src, dst, plan['outdir']))
+
+        # different files going to the same place, none of them are exported
+        sources = {}
+        for wf_id, src, dst, _ in tasks:
+            sources.setdefault(dst, set()).add(src)
+        failed = set()
+        for wf_id, src, dst, _ in tasks:
+            if len(sources[dst]) > 1:
+                print(f"Cannot export {src} from {wf_id}, {dst} is also the destination of another output file")
+                failed.add(wf_id)
+        tasks = [t for t in tasks if len(sources[t[2]]) == 1]
+
+        results = executor.map(lambda t: (t[0], export_file(*t, manifests=manifests, mode=mode, verify=verify, checksums=checksums)), tasks)
+
+        res = {plan['id']: plan['status'] == 'Succeeded' and plan['id'] not in failed for plan in plans}
+        try:
+            for wf_id, ok in results:
+                res[wf_id] = res[wf_id] and ok
+        finally:
+            for manifest_dir, manifest in manifests.items():
+                save_manifest(manifest_dir, manifest)
+
+    # moved files no longer count towards the disk usage of the workflow
+    if mode == 'move':
+        for wf_id in set(t[0] for t in tasks):
+            cromwell_cache.delete(wf_id, 'du')
+
+    # one label per workflow, not one per file
+    labelled = set()
+    for plan in plans:
+        if res[plan['id']] and not manifests[plan['outdir']].get(plan['id'], {}).get('exported', False):
+            st = cromwell_api.workflow_labels_set(wf_id=plan['id'], data={'exported': 'true'})
+            if 'labels' not in st:
+                print(f"Could not label {plan['id']} as exported: {st.get('status', None)}")
+                continue
+            manifests[plan['outdir']].setdefault(plan['id'], {'files': {}})['exported'] = True
+            labelled.add(plan['outdir'])
+
+    for manifest_dir in labelled:
+        save_manifest(manifest_dir, manifests[manifest_dir])
+
+    return res
+
+
+def verify_file(filename:str, entry:dict, full:bool=False) -> tuple:
+    ''' checks an exported file against its manifest entry, only re-hashing it if the size or mtime changed '''
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return 'missing', entry
+
+    if not full and 'md5' in entry and st.st_size == entry['size'] and st.st_mtime == entry['mtime']:
+        return 'ok', entry
+
+    new_entry = dict(entry)
+    new_entry.update(checksum(filename))
+    if 'md5' not in entry:
+        return 'added', new_entry
+    if new_entry['md5'] != entry['md5']:
+        return 'changed', entry
+
+    # touched but not changed, the new mtime is recorded so it is not hashed again
+    return 'ok', new_entry
+
+
+def verify(outdir:str, wf_ids:list=None, full:bool=False, jobs:int=8) -> dict:
+    ''' verifies the files in an export manifest, files without checksums get them added. Returns filename -> state '''
+
+    manifest = load_manifest(outdir)
+
+    files = []
+    for wf_id, wf in manifest.items():
+        if wf_ids and wf_id not in wf_ids:
+            continue
+        files += [(wf_id, filename, entry) for filename, entry in wf.get('files', {}).items()]
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        results = list(executor.map(lambda f: verify_file(f[1], f[2], full), files))
+
+    res = {}
+    for (wf_id, filename, _), (state, entry) in zip(files, results):
+        manifest[wf_id]['files'][filename] = entry
+        res[filename] = state
+
+    save_manifest(outdir, manifest)
+    return res
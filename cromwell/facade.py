@@ -1,20 +1,54 @@
 
 import re
-import os
 import shutil
 import sys
+import time
 import json
 from datetime import datetime, timedelta
 import tabulate
-import tempfile
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 
 import kbr.args_utils as args_utils
 import kbr.datetime_utils as datetime_utils
-import kbr.file_utils as file_utils
 
 import cromwell.api as cromwell_api
+import cromwell.cache as cromwell_cache
+import cromwell.calls as cromwell_calls
+import cromwell.disk as cromwell_disk
+import cromwell.export as cromwell_export
+import cromwell.index as cromwell_index
+import cromwell.stats as cromwell_stats
+import cromwell.timeline as cromwell_timeline
+import cromwell.utils as cromwell_utils
 
+# metadata keys the facade commands read, so only these are fetched from the server
+meta_keys = {'meta':     ['workflowName', 'status', 'submission', 'start', 'end', 'workflowRoot', 'outputs'],
+             'calls':    ['executionStatus'],
+             'cleanup':  ['workflowRoot', 'status', 'outputs', 'executionStatus', 'callRoot'],
+             'resubmit': ['submittedFiles'],
+             'du':       ['workflowName', 'status', 'labels', 'callRoot', 'shardIndex'],
+             }
+# workflows in these states block a resubmission with the same fingerprint
+fingerprint_states = ['Submitted', 'On Hold', 'Running', 'Succeeded']
+
+# max number of requests in flight for the multi-id commands
+jobs = 8
+
+# what the disk usage report can be grouped by
+du_groups = ['workflow', 'name', 'sample', 'env', 'user', 'call', 'shard']
+
+# files kept in the call dirs when cleaning up
+wf_keep_files = ["rc", "stdout.submit", "stderr.submit", "script", "stdout", "stderr", "script.submit"]
+
+
+def fan_out(func, args:list, **kwargs) -> list:
+    ''' calls func for every arg in a thread pool, results are returned in the same order as args '''
+    if jobs <= 1 or len(args) <= 1:
+        return [func(arg, **kwargs) for arg in args]
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(args))) as executor:
+        return list(executor.map(lambda arg: func(arg, **kwargs), args))
 
 
 def group_args(args) -> dict:
@@ -83,42 +117,24 @@ def batch_submit_workflow(args, as_json:bool=False) -> None:
             print(f'{s["id"]}\t{s["status"]}\t')
 
 
-def write_to_tmpfile(data) -> str:
-
-    if data is None:
-        return None
-
-    tmpfile = tempfile.NamedTemporaryFile(mode="w", delete=False)
-    tmpfile.write( data)
-#    json.dump(data, tmpfile.file)
-    tmpfile.close()
-
-    return tmpfile.name
-
-def del_files(*files) -> None:
-    for f in files:
-        if f is not None and os.path.isfile( f ):
-            os.remove(f)
-
-
 def resubmit_workflows(args:list, wdl_zip:str=None, as_json:bool=False) -> None:
 
     for wf_id in args:
-        wf_meta = cromwell_api.workflow_meta(wf_id=wf_id)
+        wf_meta = cromwell_cache.workflow_meta(wf_id=wf_id, include_keys=meta_keys['resubmit'])
 
         options  = wf_meta['submittedFiles'].get('options', None)
         labels   = wf_meta['submittedFiles'].get('labels', None)
         inputs   = wf_meta['submittedFiles'].get('inputs', None)
         workflow = wf_meta['submittedFiles'].get('workflow' , None)
 
-        tmp_options = write_to_tmpfile( options )
-        tmp_labels  = write_to_tmpfile( labels )
-        tmp_inputs  = write_to_tmpfile( inputs )
-        tmp_wf_file = write_to_tmpfile( workflow )
+        # the submitted files are the original contents, sent as bytes so they are not taken for filenames
+        options  = options.encode() if options is not None else None
+        labels   = labels.encode() if labels is not None else None
+        inputs   = [inputs.encode()] if inputs is not None else []
 
-        st = cromwell_api.submit_workflow(wdl_file=tmp_wf_file, inputs=[tmp_inputs], options=tmp_options, labels=tmp_labels, dependency=wdl_zip)
+        st = cromwell_api.submit_workflow(wdl_file=workflow.encode(), inputs=inputs, options=options, labels=labels,
+                                          dependency=cromwell_utils.dependency_zip(wdl_zip) if wdl_zip else None)
         print(f"{st['id']}: {st['status']}")
-        del_files( tmp_inputs, tmp_options, tmp_labels, tmp_wf_file)
     
 
 
@@ -127,8 +143,7 @@ def workflow_status(args, as_json:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
     jsons = []
-    for wf_id in args:
-        st = cromwell_api.workflow_status(wf_id)
+    for st in fan_out(cromwell_api.workflow_status, args):
         if as_json:
             jsons.append( st )
         else:
@@ -140,8 +155,13 @@ def workflow_status(args, as_json:bool=False) -> None:
 def workflow_abort(args, as_json:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
-    for wf_id in args:
-        st = cromwell_api.workflow_abort(wf_id)
+    sts = fan_out(cromwell_api.workflow_abort, args)
+
+    if as_json:
+        print(json.dumps(sts))
+        return
+
+    for st in sts:
         print(f'{st["id"]}\t{st["status"]}')
 
 
@@ -150,10 +170,11 @@ def workflow_labels_get(args, as_json:bool=False) -> None:
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
     jsons = []
 
-    for wf_id in args:
-        st = cromwell_api.workflow_labels_get(wf_id)
+    for wf_id, st in zip(args, fan_out(cromwell_api.workflow_labels_get, args)):
         if as_json:
             jsons.append( st )
+        elif 'labels' not in st:
+            print(f'{st["id"]}\t{st["status"]}')
         else:
             for label in st['labels']:
                 if label != 'cromwell-workflow-id':
@@ -185,8 +206,7 @@ def workflow_logs(args, as_json:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
     jsons = []
-    for wf_id in args:
-        st = cromwell_api.workflow_logs(wf_id)
+    for wf_id, st in zip(args, fan_out(cromwell_api.workflow_logs, args)):
         if as_json:
             jsons.append(st)
         elif 'status' in st:
@@ -204,8 +224,7 @@ def workflow_outputs(args:list, as_json:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
     jsons = []
-    for wf_id in args:
-        st = cromwell_api.workflow_outputs(wf_id)
+    for wf_id, st in zip(args, fan_out(cromwell_cache.workflow_outputs, args)):
         if as_json:
             jsons.append( st )
         elif 'status' in st:
@@ -221,60 +240,36 @@ def workflow_outputs(args:list, as_json:bool=False) -> None:
 
 
 
-def export_workflow_outputs(args:list, outdir:str=".") -> None:
+def export_workflow_outputs(args:list, outdir:str=".", mode:str='move', verify:bool=False, checksums:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
-    for wf_id in args:
-        st = cromwell_api.workflow_outputs(wf_id)
-        if outdir is None:
-
-            labels = cromwell_api.workflow_labels_get(wf_id)
-            if 'outdir' in st['labels']:
-                print('taking outdir from label')
-                outdir = st['labels']['outdir']
-            else:
-                print('Exporting to cwd')
-                outdir = os.getcwd()
-
-        if 'status' in st:
-            print(f'Cannot export output files for {st["id"]} as status is {st["status"]}')
-        else:
-            for output in st['outputs']:
-                _, name = output.split(".")
-                if not isinstance(st['outputs'][output], list):
-                    st['outputs'][output] = [st['outputs'][output]]
-
-                for of in st['outputs'][output]:
-                    if of is None:
-                        continue
-                    
-                    if not os.path.isfile( of ):
-                        print(f"{of} no longer on disk...")
-                        continue
-
-                    print( of )
-                    if of is None:
-                        continue
-                    outfile = re.sub(r'.*\/execution/', '', of)
-                    outfile = re.sub(r'^./', '', outfile)
-                    if os.path.isfile( f"{outdir}/{outfile}" ):
-                        if file_utils.size(of) == file_utils.size(f"{outdir}/{outfile}" ):
-                            print(f"{outfile} is already present in {outdir} and files have the same size")
-                        else:
-                            print(f"{outfile} is already present in {outdir} and files have differnt sizes")
-                        continue
-
-                    print (f"Moving {of} -- > {outdir}/{outfile}")
-                    shutil.move(of, f"{outdir}/{outfile}")
-                    cromwell_api.workflow_labels_set(wf_id=wf_id, data={'exported': True})
+    cromwell_export.export(args, outdir=outdir, mode=mode, verify=verify, checksums=checksums, jobs=jobs)
+
+
+def verify_export(args:list, outdir:str=".", full:bool=False, as_json:bool=False) -> None:
+
+    res = cromwell_export.verify(outdir, wf_ids=args, full=full, jobs=jobs)
+
+    if as_json:
+        print(json.dumps(res))
+        return
+
+    counts = {}
+    for filename, state in sorted(res.items()):
+        counts[ state ] = counts.get(state, 0) + 1
+        if state != 'ok':
+            print(f"{state}\t{filename}")
+
+    print(", ".join(f"{state}: {count}" for state, count in sorted(counts.items())))
 
 
 def workflow_meta(args, as_json:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
     jsons = []
-    for wf_id in args:
-        st = cromwell_api.workflow_meta(wf_id)
+    # the json output is the full document, the table only needs a few keys
+    include_keys = None if as_json else meta_keys['meta']
+    for wf_id, st in zip(args, fan_out(cromwell_cache.workflow_meta, args, include_keys=include_keys)):
         if as_json:
             jsons.append(st)
         else:
@@ -300,151 +295,236 @@ def workflow_meta(args, as_json:bool=False) -> None:
     if as_json:
         print(json.dumps(jsons))
 
-def workflows(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None, 
-              query:bool=False, as_json:bool=False) -> None:
+def plan_queries(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None,
+                 exclude_labels:list=None, any_labels:list=None, include_subworkflows:bool=False, id_chunk_size:int=500) -> list:
+    ''' turns the filters into as few query requests as possible.
+
+    Cromwell ors repeated values of the same key and ands the different keys, so everything fits in one request.
+    Only long id lists are split over several requests to keep the request size sane.
+    '''
     data = []
 
-    filter = {}
+    from_date = first_element_or_default(from_date, from_date)
+    to_date   = first_element_or_default(to_date, to_date)
 
     if from_date is not None:
-        if isinstance(from_date, list) and len(from_date):
-            from_date = from_date[0]
-        filter['start'] = from_date
+        data.append({'start': from_date})
 
     if to_date is not None:
-        if isinstance(to_date, list) and len(to_date):
-            to_date = to_date[0]
-        filter['end'] = to_date
+        data.append({'end': to_date})
 
-    if status is not None:
-        if query:
-            filter['status'] = first_element_or_default(status)
-        else:
-            for st in status:
-                data.append({'status': st})
+    for key, values in [('status', status), ('name', names), ('label', labels), ('labelor', any_labels),
+                        ('excludeLabelOr', exclude_labels)]:
+        for value in values or []:
+            data.append({key: value})
 
-    if names is not None:
-        if query:
-            filter['name'] = first_element_or_default(names)
-        else:
-            for nm in names:
-                data.append({'name': nm})
+    if not include_subworkflows:
+        data.append({'includeSubworkflows': 'false'})
 
-    if labels is not None:
-        if query:
-            filter['label'] = first_element_or_default(labels)
-        else:
-            for label in labels:
-                data.append({'label': label})
+    if not ids:
+        return [data]
 
-    if ids is not None:
-        if query:
-            filter['id'] = first_element_or_default(ids)
-        else:
-            for i in ids:
-                data.append({'id': i})
+    queries = []
+    for i in range(0, len(ids), id_chunk_size):
+        queries.append(data + [{'id': wf_id} for wf_id in ids[i:i+id_chunk_size]])
 
-    if query and filter != {}:
-        data = [filter]
-    else:
-        data.append(filter)
+    return queries
 
-#    print(data)
 
-    st = cromwell_api.workflows(data)
+def query_workflows(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None,
+                    page_size:int=1000, exclude_labels:list=None, any_labels:list=None, include_subworkflows:bool=False):
+    ''' the workflows matching the filters, raises a QueryError if a query fails '''
 
-    res = [["id", "name", "status", "submitted", "started", "ended"]]
-    jsons = []
+    queries = plan_queries(from_date, to_date, status, names, ids, labels, exclude_labels, any_labels, include_subworkflows)
 
-    if 'results' in st:
-        for r in st['results']:
+    seen = set()
+    for data in queries:
+        for r in cromwell_api.workflows_iter(data, page_size=page_size):
+            if not include_subworkflows and 'parentWorkflowId' in r:
+                continue
 
-            if 'parentWorkflowId' in r:
+            if r['id'] in seen:
                 continue
+            seen.add(r['id'])
 
-            jsons.append( r )
-    else:
+            yield r
+
+
+def iter_workflows(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None,
+                   query:bool=False, as_json:bool=False, page_size:int=1000, exclude_labels:list=None, any_labels:list=None,
+                   include_subworkflows:bool=False):
+    ''' like workflows, but yields the workflows page by page as they come from the server '''
+
+    try:
+        yield from query_workflows(from_date, to_date, status, names, ids, labels, page_size, exclude_labels, any_labels,
+                                   include_subworkflows)
+    except cromwell_api.QueryError as e:
         if as_json:
-            print(json.dumps(st))
+            print(json.dumps(e.response))
         else:
-            print(f"Query error: {st['status']}")
+            print(e)
 
         sys.exit(10)
 
-    return jsons
-        
-
-def cleanup_workflow(action:str, wf_id:str, keep_running_wfs:bool=True) -> None:
-    outputs = {}
 
-    meta = cromwell_api.workflow_meta(wf_id)
-    rootdir = meta.get('workflowRoot', None)
-    status  = meta.get('status', None)
-    start   = meta.get('start', None)
-    end     = meta.get('end', None)
+def fingerprint_workflow(fingerprint:str) -> dict:
+    ''' an existing workflow, that has not failed or been aborted, with the fingerprint label '''
 
-    workflow_stats = ['Submitted', 'Running', 'Aborting', 'Failed', 'Succeeded', 'Aborted']
+    data = [{'label': f'fingerprint:{fingerprint}'}, {'pageSize': '1'}] + [{'status': st} for st in fingerprint_states]
+    r = cromwell_api.workflows(data)
+    if 'results' not in r:
+        raise cromwell_api.QueryError(r)
 
+    for row in r['results']:
+        return row
 
-    if action == 'nuke':
-        try:
-            shutil.rmtree(rootdir)
-        except OSError as e:
-            print("Error: %s : %s" % (rootdir, e.strerror))
+    return None
 
-        print(f"Deleted everything in {rootdir}")
-        return
 
-    if 'outputs' in meta:
-        for output in meta['outputs']:
-            outputs[ output ] = meta['outputs'][output]
+def local_workflows(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None,
+                    refresh:bool=False, exclude_labels:list=None, any_labels:list=None) -> list:
+    ''' answers the query from the local index, after syncing newly submitted workflows into it '''
 
-    wf_keep_files = ["rc","stdout.submit", "stderr.submit", "script",
-                     "stdout", "stderr", "script.submit" ]
+    cromwell_index.sync()
+    if refresh:
+        cromwell_index.refresh()
 
-    kf = cromwell_api.workflow_outputs(wf_id)
-    output_files = []
-    for kf in list(kf['outputs'].values()):
-        if isinstance(kf, list):
-            output_files += list(kf)
-        elif kf is not None:
-            output_files.append( kf )
+    from_date = first_element_or_default(from_date, from_date)
+    to_date   = first_element_or_default(to_date, to_date)
 
+    return cromwell_index.find(from_date, to_date, status, names, ids, labels, exclude_labels=exclude_labels, any_labels=any_labels)
 
-    for call in meta['calls']:
-        for shard in meta['calls'][call]:
-            shard_status = shard.get('executionStatus', None)
-            shard_rootdir = shard.get('callRoot', None)
 
-            if keep_running_wfs and shard_status not in ['Submitted', 'Running', 'Aborting']:
-                print(f"keeping {shard_rootdir} as status is {shard_status} ")
-                continue
+def workflows(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None, 
+              query:bool=False, as_json:bool=False, local:bool=False, refresh:bool=False, exclude_labels:list=None,
+              any_labels:list=None) -> list:
 
-            if action == 'tmpfiles':
-                delete_workflow_files( shard_rootdir, list(output_files + wf_keep_files))
-            elif action == 'files':
-                delete_workflow_files( shard_rootdir, wf_keep_files)
-            else:
-                raise RuntimeError(f'{action} is an unknown cleanup action, allowed: tmpfiles, files or nuke')
+    # query is kept for backwards compatibility, all filter values are used in both modes now
+    if local:
+        return local_workflows(from_date, to_date, status, names, ids, labels, refresh=refresh, exclude_labels=exclude_labels,
+                               any_labels=any_labels)
 
+    return list(iter_workflows(from_date, to_date, status, names, ids, labels, query, as_json, exclude_labels=exclude_labels,
+                               any_labels=any_labels))
+        
 
+def cleanup_plan(action:str, wf_id:str, table:cromwell_calls.CallTable, keep_running_wfs:bool=True) -> list:
+    ''' (wf_id, call, dir, keep_names, keep_paths, prune) for the dirs to clean, the keep set is taken from the workflow
+        outputs. Retries run in a dir inside the first attempt's dir, so only the outermost dirs are walked '''
 
-def delete_workflow_files(root_dir:str, keep_list:list) -> None:
-    if root_dir is None:
-        return 
+    if action not in ['tmpfiles', 'files', 'nuke']:
+        raise RuntimeError(f'{action} is an unknown cleanup action, allowed: tmpfiles, files or nuke')
 
-    for root, dirs, files in os.walk(root_dir):
-        for filename in files:
-            filepath = f"{root}/{filename}"
-            if filename in keep_list or filepath in keep_list:
-                print(f"Keeping {filename}")
+    if action == 'nuke':
+        return [(wf_id, '*', table.fields.get('workflowRoot', None), None, None, None)]
+
+    keep_names = set(wf_keep_files)
+    keep_paths = set()
+    if action == 'tmpfiles':
+        for of in (table.fields.get('outputs', None) or {}).values():
+            if isinstance(of, list):
+                keep_paths.update(of)
+            elif of is not None:
+                keep_paths.add( of )
+
+    rows = table.all()
+    prune = set()
+    if keep_running_wfs:
+        running = table.select(status=['Submitted', 'Running', 'Aborting'])
+        for row in running:
+            print(f"keeping {table.root[row]} as status is {table.status[row]} ")
+            if table.root[row] is not None:
+                prune.add(table.root[row].rstrip('/'))
+        rows = table.reject(rows, status=['Submitted', 'Running', 'Aborting'])
+
+    calls = {}
+    for row in rows:
+        if table.root[row] is not None:
+            calls.setdefault(table.root[row].rstrip('/'), table.call[row])
+
+    tasks = []
+    for root_dir in sorted(cromwell_disk.outermost(calls.keys())):
+        # a dir inside a running shard's dir is kept with it
+        if root_dir in prune or any(root_dir.startswith(f"{kept}/") for kept in prune):
+            continue
+        tasks.append((wf_id, calls[root_dir], root_dir, keep_names, keep_paths, prune))
+
+    return tasks
+
+
+def cleanup_dir(task:tuple, dry_run:bool=False) -> dict:
+    _, call, root_dir, keep_names, keep_paths, prune = task
+
+    if call != '*':
+        return cromwell_disk.delete_files(root_dir, keep_names, keep_paths, dry_run=dry_run, prune=prune)
+
+    # nuke, the whole workflow dir goes. The files are counted as they are deleted, so the tree is only walked once
+    usage = cromwell_disk.delete_files(root_dir, dry_run=dry_run)
+    if not dry_run and root_dir is not None:
+        try:
+            shutil.rmtree(root_dir)
+        except OSError as e:
+            # the files are gone already, only dirs are left
+            print("Error: %s : %s" % (root_dir, e.strerror))
+            return usage
+        print(f"Deleted everything in {root_dir}")
+
+    return usage
+
+
+def cleanup_workflows(action:str, ids:list, keep_running_wfs:bool=True, dry_run:bool=False, chunk_size:int=100) -> tuple:
+    ''' cleans up workflows in chunks: metadata fetch -> plan -> delete -> label, each stage runs in parallel.
+        Returns wf_id -> call -> files/bytes deleted, and the time spent per stage '''
+
+    timings = {'metadata': 0.0, 'plan': 0.0, 'delete': 0.0, 'labels': 0.0}
+    res = {}
+
+    ids = iter(ids)
+    while True:
+        chunk = [wf_id for _, wf_id in zip(range(chunk_size), ids)]
+        if not chunk:
+            break
+
+        start = time.time()
+        tables = fan_out(cromwell_calls.call_table, chunk, include_keys=meta_keys['cleanup'])
+        timings['metadata'] += time.time() - start
+
+        start = time.time()
+        tasks = []
+        cleaned = []
+        for wf_id, table in zip(chunk, tables):
+            status = table.fields.get('status', None)
+            if status not in cromwell_cache.workflow_states:
+                print(f"Cannot cleanup {wf_id} as status is {status}")
                 continue
-
-            print(f"Deleting {filename}")
-            os.unlink(filepath)
-
-
-def cleanup(action:str, ids:list=None, time_type:str=None, time_span:str=None, ) -> None:
+            tasks += cleanup_plan(action, wf_id, table, keep_running_wfs)
+            cleaned.append(wf_id)
+            res[ wf_id ] = {}
+        timings['plan'] += time.time() - start
+
+        start = time.time()
+        usages = fan_out(cleanup_dir, tasks, dry_run=dry_run)
+        for (wf_id, call, _, _, _, _), usage in zip(tasks, usages):
+            call_usage = res[ wf_id ].setdefault(call, {'files': 0, 'bytes': 0})
+            call_usage['files'] += usage['files']
+            call_usage['bytes'] += usage['bytes']
+        if not dry_run:
+            for wf_id in cleaned:
+                cromwell_cache.delete(wf_id, 'du')
+        timings['delete'] += time.time() - start
+
+        if not dry_run:
+            start = time.time()
+            sts = fan_out(cromwell_api.workflow_labels_set, cleaned, data={'cleanup': action})
+            for wf_id, st in zip(cleaned, sts):
+                if 'labels' not in st:
+                    print(f"Could not label {wf_id}: {st.get('status', None)}")
+            timings['labels'] += time.time() - start
+
+    return res, timings
+
+
+def cleanup(action:str, ids:list=None, time_type:str=None, time_span:str=None, dry_run:bool=False) -> None:
 
     keep_running = False
 
@@ -455,60 +535,202 @@ def cleanup(action:str, ids:list=None, time_type:str=None, time_span:str=None, )
         elif time_type == 'hours':
             to_date = datetime_utils.to_string( datetime.now(pytz.utc) - timedelta(hours=int(time_span)) )
 
-        workflows_data = workflows(to_date=to_date, as_json=True, query=True)
-        ids = []
-        for workflow in workflows_data:
-            ids.append(workflow['id'])
+        ids = (workflow['id'] for workflow in iter_workflows(to_date=to_date, as_json=True, query=True))
+
+    res, timings = cleanup_workflows(action=action, ids=ids, keep_running_wfs=keep_running, dry_run=dry_run)
+
+    verb = 'reclaimable' if dry_run else 'deleted'
+    total = {'files': 0, 'bytes': 0}
+    for id, usage in res.items():
+        for call, call_usage in sorted(usage.items()):
+            print(f"{id}\t{call}\t{call_usage['files']} files\t{cromwell_disk.human_size(call_usage['bytes'])} {verb}")
+            total['files'] += call_usage['files']
+            total['bytes'] += call_usage['bytes']
+
+    print(f"total\t{len(res)} workflows\t{total['files']} files\t{cromwell_disk.human_size(total['bytes'])} {verb}")
+    print("timings\t" + ", ".join(f"{stage}: {seconds:.1f}s" for stage, seconds in timings.items()))
+
 
+def workflow_du(wf_id:str) -> dict:
+    ''' disk usage of a workflow per call and shard, for finished workflows it is served from/stored in the cache '''
 
-    for id in ids:
-        cleanup_workflow(action=action, wf_id=id, keep_running_wfs=keep_running)
-        workflow_labels_set(id, [f"cleanup:{action}"])
+    if cromwell_cache.enabled:
+        data = cromwell_cache.get(wf_id, 'du')
+        if data is not None:
+            return data
+
+    table = cromwell_calls.call_table(wf_id, include_keys=meta_keys['du'])
+    meta = table.fields
+    status = meta.get('status', None)
+    if status not in cromwell_cache.workflow_states:
+        return {'id': wf_id, 'status': status}
+
+    shards = list(zip(table.column('call'), map(str, table.column('shard')), table.column('root')))
+
+    # retries are in a dir inside the first attempt's dir, and are counted with it
+    roots = cromwell_disk.outermost([root_dir for _, _, root_dir in shards])
+    todo = []
+    for call, index, root_dir in shards:
+        if root_dir is not None and root_dir.rstrip('/') in roots:
+            roots.remove(root_dir.rstrip('/'))
+            todo.append((call, index, root_dir))
+
+    res = {'id': wf_id, 'name': meta.get('workflowName', None), 'status': status, 'labels': meta.get('labels', {}),
+           'files': 0, 'bytes': 0, 'size': 0, 'calls': {}}
+
+    for (call, index, _), usage in zip(todo, fan_out(cromwell_disk.usage, [root_dir for _, _, root_dir in todo])):
+        call_usage = res['calls'].setdefault(call, {'files': 0, 'bytes': 0, 'size': 0, 'shards': {}})
+        call_usage['shards'][index] = usage
+        for k in ['files', 'bytes', 'size']:
+            call_usage[k] += usage[k]
+            res[k] += usage[k]
+
+    if cromwell_cache.enabled and status in cromwell_cache.terminal_states:
+        cromwell_cache.put(wf_id, 'du', res)
+
+    return res
+
+
+def disk_usage(ids, group_by:str='workflow', sort:str='bytes', as_json:bool=False) -> None:
+    ''' du style report, grouped by workflow, workflow name, sample/env/user label, call or shard '''
+
+    if group_by not in du_groups:
+        raise RuntimeError(f"cannot group by {group_by}, allowed: {', '.join(du_groups)}")
+
+    headers = {'workflow': ['id', 'name'], 'name': ['name'], 'sample': ['sample'], 'env': ['env'], 'user': ['user'],
+               'call': ['call'], 'shard': ['id', 'call', 'shard']}[group_by]
+
+    rows = {}
+    for du in map(workflow_du, ids):
+        if 'calls' not in du:
+            print(f"Cannot get the disk usage for {du['id']} as status is {du['status']}")
+            continue
+
+        if group_by == 'workflow':
+            usages = [((du['id'], du['name']), du)]
+        elif group_by == 'name':
+            usages = [((du['name'],), du)]
+        elif group_by in ['sample', 'env', 'user']:
+            usages = [((du['labels'].get(group_by, ''),), du)]
+        elif group_by == 'call':
+            usages = [((call,), usage) for call, usage in du['calls'].items()]
+        else:
+            usages = [((du['id'], call, index), usage) for call, call_usage in du['calls'].items()
+                      for index, usage in call_usage['shards'].items()]
+
+        for key, usage in usages:
+            row = rows.setdefault(key, {'workflows': set(), 'files': 0, 'bytes': 0, 'size': 0})
+            row['workflows'].add(du['id'])
+            for k in ['files', 'bytes', 'size']:
+                row[k] += usage[k]
+
+    res = []
+    for key, row in rows.items():
+        res.append(dict(zip(headers, key), workflows=len(row['workflows']), files=row['files'], bytes=row['bytes'], size=row['size']))
+
+    if sort in ['bytes', 'size', 'files', 'workflows']:
+        res = sorted(res, key=lambda r: r[sort], reverse=True)
+    elif sort in headers:
+        res = sorted(res, key=lambda r: str(r[sort]))
+    else:
+        raise RuntimeError(f"cannot sort by {sort}, allowed: {', '.join(headers + ['workflows', 'files', 'bytes', 'size'])}")
+
+    if as_json:
+        print(json.dumps(res))
+        return
+
+    table = [[r[h] for h in headers] + [r['workflows'], r['files'], cromwell_disk.human_size(r['bytes']), cromwell_disk.human_size(r['size'])]
+             for r in res]
+    print(tabulate.tabulate(table, headers=headers + ['workflows', 'files', 'disk', 'size'], tablefmt='psql'))
 
 
 def workflow_fails(args:list, as_json:bool=False) -> None:
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
-    jsons = []
-    for wf_id in args:
-        st = cromwell_api.workflow_meta(wf_id)
+    for wf_id, table in zip(args, fan_out(cromwell_calls.call_table, args, include_keys=meta_keys['calls'])):
+        for call in table.column('call', table.select(status='Failed')):
+            print(f"{wf_id}\t{call}")
+
 
-        if 'calls' in st:
-            for call in st['calls']:
-                for shard in st['calls'][call]:
-                    if "executionStatus" in shard and shard['executionStatus'] == 'Failed':                        
-                        print(f"{wf_id}\t{call}")
+def workflow_overview(args:list, as_json:bool=False) -> None:
 
-        if False and 'failures' in st:
-            for failure in st['failures']:
-                if "causedBy" in failure:
-                    for cb in failure[ 'causedBy' ]:
-                        print(cb['message'])
+    args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
+    for wf_id, table in zip(args, fan_out(cromwell_calls.call_table, args, include_keys=meta_keys['calls'])):
+        for call, state in zip(table.column('call'), table.column('status')):
+            print(f"{wf_id}\t{call}\t{state}")
 
 
-#    if as_json:
-#        print(json.dumps(jsons))
+def duration(seconds:float) -> str:
+    if seconds is None:
+        return 'NA'
+    return str(timedelta(seconds=int(seconds)))
 
 
+def iso_time(seconds:float) -> str:
+    if seconds is None:
+        return ''
+    return datetime.fromtimestamp(seconds, pytz.utc).isoformat()
 
-def workflow_overview(args:list, as_json:bool=False) -> None:
+
+def workflow_timeline(args:list, as_json:bool=False, outfile:str=None) -> None:
+    ''' wall/queue/run time per call, scatter width and the critical path. With outfile the shards are written as tsv '''
 
     args_utils.min_count(1, len(args), 1, msg="one or more workflow id is required")
-    jsons = []
-    for wf_id in args:
-        st = cromwell_api.workflow_meta(wf_id)
 
-        if 'calls' in st:
-            for call in st['calls']:
-                for shard in st['calls'][call]:
-                   print(f"{wf_id}\t{call}\t{shard['executionStatus']}")
+    now = time.time()
+    timelines = fan_out(cromwell_timeline.timeline, args, now=now)
+
+    if outfile is not None:
+        with open(outfile, 'w') as fh:
+            fh.write("\t".join(['id', 'parent', 'call', 'shard', 'attempt', 'status', 'start', 'end', 'wall', 'queue', 'run']) + "\n")
+            for tl in timelines:
+                for s in tl.get('shards', []):
+                    fh.write("\t".join(map(str, [tl['id'], s['parent'], s['call'], s['shard'], s['attempt'], s['status'], iso_time(s['start']),
+                                                  iso_time(s['end'])] + ['' if s[k] is None else s[k] for k in ['wall', 'queue', 'run']])) + "\n")
+
+    if as_json:
+        print(json.dumps(timelines))
+        return
 
+    for tl in timelines:
+        if 'calls' not in tl:
+            print(f"{tl['id']}\tno timeline as status is {tl['status']}")
+            continue
 
+        print(f"{tl['id']}\t{tl['name']}\t{tl['status']}\twall time: {duration(tl['wall'])}\t"
+              f"max running shards: {max([n for _, n in tl['width']] or [0])}")
 
-#        if as_json:
-#            jsons.append( st )
+        res = [['call', 'shards', 'retries', 'started', 'wall', 'queue (sum)', 'run (sum)', 'longest shard', 'max width']]
+        for c in tl['calls']:
+            res.append([c['call'], c['shards'], c['retries'], '+' + duration(c['start'] - tl['start']), duration(c['wall']),
+                        duration(c['queue']), duration(c['run']), duration(c['longest']), c['width']])
+        print(tabulate.tabulate(res, headers="firstrow", tablefmt='psql'))
 
-#    if as_json:
-#        print(json.dumps(jsons))
+        print("critical path:")
+        res = [['call', 'shard', 'attempt', 'started', 'wall', 'queue', 'run', 'waited']]
+        for s in tl['critical_path']:
+            res.append([s['call'], s['shard'], s['attempt'], '+' + duration(s['start'] - tl['start']), duration(s['wall']),
+                        duration(s['queue']), duration(s['run']), duration(s['gap'])])
+        print(tabulate.tabulate(res, headers="firstrow", tablefmt='psql'))
+        print("")
 
 
+def task_stats(ids:list, as_json:bool=False) -> None:
+    ''' runtime distribution, retry/preemption rates and call cache hits per task over the workflows '''
+
+    records = fan_out(cromwell_stats.task_records, ids)
+    for record in records:
+        if 'tasks' not in record:
+            print(f"Skipping {record['id']} as status is {record['status']}")
+
+    res = cromwell_stats.aggregate(records)
+
+    if as_json:
+        print(json.dumps(res))
+        return
+
+    table = [['task', 'workflows', 'count', 'median', 'p95', 'max', 'retry rate', 'preemption rate', 'cache hits']]
+    for r in res:
+        table.append([r['task'], r['workflows'], r['count'], duration(r['median']), duration(r['p95']), duration(r['max']),
+                      f"{r['retry_rate']:.1%}", f"{r['preemption_rate']:.1%}", f"{r['cache_hit_ratio']:.1%}"])
+    print(tabulate.tabulate(table, headers="firstrow", tablefmt='psql'))
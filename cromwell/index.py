@@ -0,0 +1,175 @@
+import os
+import json
+import sqlite3
+
+import cromwell.api as cromwell_api
+import cromwell.cache as cromwell_cache
+
+
+index_file = os.environ.get('CROMWELL_INDEX', os.path.join(cromwell_cache.cache_dir, 'index.sqlite'))
+
+schema = ['''CREATE TABLE IF NOT EXISTS workflow (
+                 id          TEXT PRIMARY KEY,
+                 name        TEXT,
+                 status      TEXT,
+                 submission  TEXT,
+                 start       TEXT,
+                 "end"       TEXT,
+                 parent_id   TEXT,
+                 labels      TEXT)''',
+          '''CREATE TABLE IF NOT EXISTS label (
+                 id     TEXT,
+                 key    TEXT,
+                 value  TEXT,
+                 PRIMARY KEY (id, key))''',
+          '''CREATE TABLE IF NOT EXISTS sync (
+                 key    TEXT PRIMARY KEY,
+                 value  TEXT)''',
+          'CREATE INDEX IF NOT EXISTS workflow_status_idx ON workflow (status, submission)',
+          'CREATE INDEX IF NOT EXISTS workflow_name_idx ON workflow (name, submission)',
+          'CREATE INDEX IF NOT EXISTS workflow_submission_idx ON workflow (submission)',
+          'CREATE INDEX IF NOT EXISTS workflow_parent_idx ON workflow (parent_id)',
+          'CREATE INDEX IF NOT EXISTS label_key_value_idx ON label (key, value)',
+          ]
+
+query_fields = [{'additionalQueryResultFields': 'labels'},
+                {'additionalQueryResultFields': 'parentWorkflowId'}]
+
+
+def init(path:str=None) -> None:
+    global index_file
+    if path is not None:
+        index_file = path
+
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+    conn = sqlite3.connect(index_file)
+    conn.row_factory = sqlite3.Row
+    for stmt in schema:
+        conn.execute(stmt)
+    return conn
+
+
+def _store(conn:sqlite3.Connection, rows) -> int:
+    count = 0
+    for r in rows:
+        labels = r.get('labels', {})
+        conn.execute('INSERT OR REPLACE INTO workflow (id, name, status, submission, start, "end", parent_id, labels) VALUES (?,?,?,?,?,?,?,?)',
+                     (r['id'], r.get('name', None), r.get('status', None), r.get('submission', None), r.get('start', None),
+                      r.get('end', None), r.get('parentWorkflowId', None), json.dumps(labels)))
+        conn.execute('DELETE FROM label WHERE id = ?', (r['id'],))
+        conn.executemany('INSERT INTO label (id, key, value) VALUES (?,?,?)',
+                         [(r['id'], k, v) for k, v in labels.items()])
+        count += 1
+
+    return count
+
+
+def last_submission(conn:sqlite3.Connection) -> str:
+    r = conn.execute("SELECT value FROM sync WHERE key = 'last_submission'").fetchone()
+    if r is None:
+        return None
+    return r['value']
+
+
+def sync(full:bool=False) -> int:
+    ''' fetches workflows submitted since the last sync, returns the number of rows stored '''
+
+    conn = connect()
+    with conn:
+        since = None if full else last_submission(conn)
+
+        data = list(query_fields)
+        if since is not None:
+            # overlaps with the last row of the previous sync, rows are upserted so that is fine
+            data.append({'submission': since})
+
+        latest = since
+        rows = []
+        for r in cromwell_api.workflows_iter(data):
+            rows.append(r)
+            if r.get('submission', None) is not None and (latest is None or r['submission'] > latest):
+                latest = r['submission']
+
+        count = _store(conn, rows)
+        if latest is not None:
+            conn.execute("INSERT OR REPLACE INTO sync (key, value) VALUES ('last_submission', ?)", (latest,))
+
+    conn.close()
+    return count
+
+
+def refresh(chunk_size:int=100) -> int:
+    ''' re-fetches the rows that are not in a terminal state, returns the number of rows updated '''
+
+    conn = connect()
+    with conn:
+        marks = ",".join("?" * len(cromwell_cache.terminal_states))
+        ids = [r['id'] for r in conn.execute(f'SELECT id FROM workflow WHERE status NOT IN ({marks})', cromwell_cache.terminal_states)]
+
+        count = 0
+        for i in range(0, len(ids), chunk_size):
+            data = list(query_fields) + [{'id': wf_id} for wf_id in ids[i:i+chunk_size]]
+            count += _store(conn, cromwell_api.workflows_iter(data))
+
+    conn.close()
+    return count
+
+
+def find(from_date:str=None, to_date:str=None, status:list=None, names:list=None, ids:list=None, labels:list=None,
+         include_subworkflows:bool=False, exclude_labels:list=None, any_labels:list=None) -> list:
+    ''' workflows matching all of the given filters, values within a filter are or'ed, labels are and'ed '''
+
+    where  = []
+    values = []
+
+    if from_date is not None:
+        where.append('start >= ?')
+        values.append(from_date)
+
+    if to_date is not None:
+        where.append('"end" <= ?')
+        values.append(to_date)
+
+    for column, filter_values in [('status', status), ('name', names), ('id', ids)]:
+        if filter_values:
+            where.append(f'{column} IN ({",".join("?" * len(filter_values))})')
+            values += filter_values
+
+    for label in labels or []:
+        key, value = label.split(":", 1)
+        where.append('id IN (SELECT id FROM label WHERE key = ? AND value = ?)')
+        values += [key, value]
+
+    if any_labels:
+        where.append('(' + ' OR '.join(['id IN (SELECT id FROM label WHERE key = ? AND value = ?)'] * len(any_labels)) + ')')
+        for label in any_labels:
+            values += label.split(":", 1)
+
+    for label in exclude_labels or []:
+        key, value = label.split(":", 1)
+        where.append('id NOT IN (SELECT id FROM label WHERE key = ? AND value = ?)')
+        values += [key, value]
+
+    if not include_subworkflows:
+        where.append('parent_id IS NULL')
+
+    sql = 'SELECT * FROM workflow'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY submission DESC'
+
+    conn = connect()
+    res = []
+    for r in conn.execute(sql, values):
+        row = {'id': r['id'], 'status': r['status'], 'submission': r['submission'], 'labels': json.loads(r['labels'] or '{}')}
+        for k in ['name', 'start', 'end']:
+            if r[k] is not None:
+                row[k] = r[k]
+        if r['parent_id'] is not None:
+            row['parentWorkflowId'] = r['parent_id']
+        res.append(row)
+
+    conn.close()
+    return res
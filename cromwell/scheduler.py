@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+from contextlib import contextmanager
+
+import cromwell.api as cromwell_api
+import cromwell.utils as cromwell_utils
+import cromwell.facade as cromwell_facade
+
+
+active_states = ['Submitted', 'Running']
+
+# label every queued submission carries, so a submission interrupted by a killed process can be found on the server
+entry_label = 'queue-entry'
+
+# submissions failing with these are put back in the queue, anything else the server rejected is marked failed
+transient_states = ['server unavailable', 'Internal error']
+
+# extra priority for queued workflows carrying these labels, eg: {'env:production': 10, 'workflow:exome': 5}
+priorities = {}
+
+
+@contextmanager
+def locked(queue_file:str):
+    ''' exclusive lock on the queue, so several processes can add to and run the same queue '''
+    with open(f"{queue_file}.lock", 'w') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def load(queue_file:str) -> list:
+    if not os.path.isfile(queue_file):
+        return []
+
+    with open(queue_file) as fh:
+        return json.load(fh)
+
+
+def save(queue_file:str, entries:list) -> None:
+    tmpfile = f"{queue_file}.tmp"
+    with open(tmpfile, 'w') as fh:
+        json.dump(entries, fh)
+    os.replace(tmpfile, queue_file)
+
+
+def priority(entry:dict) -> int:
+    prio = entry.get('priority', 0)
+    for key, value in (entry.get('labels', None) or {}).items():
+        prio += priorities.get(f"{key}:{value}", 0)
+
+    return prio
+
+
+def enqueue(queue_file:str, wdl_wf:str, inputs:dict, options:dict=None, labels:dict=None, wdl_zip:str=None, prio:int=0) -> dict:
+    ''' adds a submission to the queue, file paths are stored as absolute paths so the queue can be run from anywhere '''
+
+    entry_id = uuid.uuid4().hex
+    entry = {'wdl_wf': os.path.abspath(wdl_wf),
+             'inputs': inputs,
+             'options': options,
+             'labels': dict(labels or {}, **{entry_label: entry_id}),
+             'entry_id': entry_id,
+             'wdl_zip': os.path.abspath(wdl_zip) if wdl_zip else None,
+             'priority': prio,
+             'state': 'queued',
+             'id': None,
+             'queued': time.time()}
+
+    with locked(queue_file):
+        entries = load(queue_file)
+        entries.append(entry)
+        save(queue_file, entries)
+
+    return entry
+
+
+def active_count() -> int:
+    ''' number of top level workflows in the Submitted or Running states on the server '''
+    data = [{'status': st} for st in active_states] + [{'includeSubworkflows': 'false'}, {'pageSize': '1'}]
+    r = cromwell_api.workflows(data)
+    if 'totalResultsCount' not in r:
+        raise cromwell_api.QueryError(r)
+
+    return r['totalResultsCount']
+
+
+def submitted_workflow(entry:dict) -> dict:
+    ''' the workflow a submission of the entry created, None if it never reached the server '''
+
+    if entry.get('entry_id', None) is None:
+        return None
+
+    data = [{'label': f"{entry_label}:{entry['entry_id']}"}, {'pageSize': '1'}]
+    r = cromwell_api.workflows(data)
+    if 'results' not in r:
+        raise cromwell_api.QueryError(r)
+
+    for row in r['results']:
+        return row
+
+    return None
+
+
+def submit(entry:dict) -> dict:
+    wdl_zip = entry.get('wdl_zip', None)
+
+    fingerprint = (entry.get('labels', None) or {}).get('fingerprint', None)
+    if fingerprint is not None:
+        existing = cromwell_facade.fingerprint_workflow(fingerprint)
+        if existing is not None:
+            print(f"{existing['id']} is already {existing['status']} with the same workflow and inputs")
+            return existing
+
+    return cromwell_api.submit_workflow(wdl_file=cromwell_utils.wdl_workflow_imports(entry['wdl_wf']), inputs=[entry['inputs']],
+                                        options=entry.get('options', None), labels=entry.get('labels', None),
+                                        dependency=cromwell_utils.dependency_zip(wdl_zip) if wdl_zip else None)
+
+
+def fill(queue_file:str, max_active:int) -> int:
+    ''' submits queued workflows until max_active are submitted/running, returns the number still queued '''
+
+    with locked(queue_file):
+        entries = load(queue_file)
+
+        # a 'submitting' entry was interrupted mid submission by a killed process, it is looked up and tried again
+        queued = [e for e in entries if e['state'] in ['queued', 'submitting']]
+        queued = sorted(queued, key=lambda e: (-priority(e), e['queued']))
+
+        slots = max_active - active_count() if queued else 0
+        for entry in queued[:max(slots, 0)]:
+            # the post of an interrupted or failed submission may have reached the server, it is looked up rather than resubmitted
+            st = submitted_workflow(entry) if entry['state'] == 'submitting' or entry.get('tries', 0) else None
+            if st is not None:
+                print(f"{st['id']} was submitted before the queue was interrupted")
+            else:
+                entry['state'] = 'submitting'
+                save(queue_file, entries)
+                st = submit(entry)
+
+            if st.get('status', None) in transient_states:
+                # the server is struggling, leave the rest for the next round
+                entry['state'] = 'queued'
+                entry['tries'] = entry.get('tries', 0) + 1
+                save(queue_file, entries)
+                print(f"submission failed ({st['status']}), will be tried again")
+                break
+
+            entry['id'] = st.get('id', None)
+            entry['state'] = 'failed' if st.get('status', None) not in cromwell_facade.fingerprint_states else 'submitted'
+            entry['status'] = st.get('status', None)
+            save(queue_file, entries)
+            print(f"{entry['id']}: {entry['status']}")
+
+        return len([e for e in entries if e['state'] in ['queued', 'submitting']])
+
+
+def run(queue_file:str, max_active:int=10, interval:int=60) -> None:
+    ''' feeds the queue to the server as slots free up, can be stopped and restarted at any point '''
+
+    while True:
+        waiting = fill(queue_file, max_active)
+        if waiting == 0:
+            break
+
+        print(f"{waiting} workflows queued, checking again in {interval}s")
+        time.sleep(interval)
+
+
+def status(queue_file:str) -> dict:
+    counts = {}
+    for entry in load(queue_file):
+        counts[ entry['state'] ] = counts.get(entry['state'], 0) + 1
+
+    return counts
@@ -0,0 +1,86 @@
+import math
+
+import cromwell.cache as cromwell_cache
+import cromwell.calls as cromwell_calls
+
+
+# the (expanded) metadata is streamed without these, callCaching is kept for the cache hits
+exclude_keys = ['inputs', 'outputs', 'submittedFiles', 'commandLine', 'runtimeAttributes', 'labels',
+                'jobId', 'stdout', 'stderr', 'backendLogs', 'failures', 'executionEvents']
+
+# backend states of jobs lost to preemption (PAPI/Life Sciences), a RetryableFailure execution status is any retry
+preempted_states = ['Preempted']
+
+
+def task_records(wf_id:str) -> dict:
+    ''' task -> runtimes of the successful shards and counts of shards/attempts/retries/preemptions/cache hits.
+        Records of terminal workflows are cached, so a report only fetches the metadata of new runs '''
+
+    if cromwell_cache.enabled:
+        data = cromwell_cache.get(wf_id, 'taskstats')
+        if data is not None:
+            return data
+
+    table = cromwell_calls.call_table(wf_id, exclude_keys=exclude_keys, expand_subworkflows=True)
+    status = table.fields.get('status', None)
+    if status not in cromwell_cache.workflow_states:
+        return {'id': wf_id, 'status': status}
+
+    tasks = {}
+    for call, rows in table.group_by('call').items():
+        shards = set(table.shard_id(row) for row in rows)
+        runtimes = []
+        for row in table.select(rows, status='Done'):
+            start, end = cromwell_calls.timestamp(table.start[row]), cromwell_calls.timestamp(table.end[row])
+            if start is not None and end is not None:
+                runtimes.append(end - start)
+
+        tasks[ call ] = {'runtimes': runtimes,
+                         'shards': len(shards),
+                         'attempts': len(rows),
+                         'retried': len(set(table.shard_id(row) for row in rows if table.attempt[row] > 1)),
+                         'preempted': len(table.select(rows, backend_status=preempted_states)),
+                         'cache_hits': len(table.select(rows, cache_hit=True))}
+
+    res = {'id': wf_id, 'status': status, 'name': table.fields.get('workflowName', None), 'tasks': tasks}
+    if cromwell_cache.enabled and status in cromwell_cache.terminal_states:
+        cromwell_cache.put(wf_id, 'taskstats', res)
+
+    return res
+
+
+def percentile(values:list, p:float) -> float:
+    ''' nearest rank percentile of sorted values '''
+    if not values:
+        return None
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[ min(rank, len(values) - 1) ]
+
+
+def aggregate(records:list) -> list:
+    ''' per task stats over the task records of many workflows '''
+
+    tasks = {}
+    for record in records:
+        for task, counts in record.get('tasks', {}).items():
+            agg = tasks.setdefault(task, {'workflows': 0, 'runtimes': [], 'shards': 0, 'attempts': 0, 'retried': 0,
+                                          'preempted': 0, 'cache_hits': 0})
+            agg['workflows'] += 1
+            agg['runtimes'] += counts['runtimes']
+            for k in ['shards', 'attempts', 'retried', 'preempted', 'cache_hits']:
+                agg[k] += counts[k]
+
+    res = []
+    for task, agg in sorted(tasks.items()):
+        runtimes = sorted(agg['runtimes'])
+        res.append({'task': task,
+                    'workflows': agg['workflows'],
+                    'count': agg['shards'],
+                    'median': percentile(runtimes, 50),
+                    'p95': percentile(runtimes, 95),
+                    'max': runtimes[-1] if runtimes else None,
+                    'retry_rate': agg['retried'] / agg['shards'] if agg['shards'] else 0,
+                    'preemption_rate': agg['preempted'] / agg['attempts'] if agg['attempts'] else 0,
+                    'cache_hit_ratio': agg['cache_hits'] / agg['attempts'] if agg['attempts'] else 0})
+
+    return res
@@ -0,0 +1,106 @@
+import json
+import codecs
+
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+class Reader(object):
+    ''' json values read one at a time from a stream of bytes/str chunks '''
+
+    def __init__(self, chunks):
+        self.chunks  = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self, size:int=0) -> None:
+        ''' reads chunks until at least size unparsed characters are buffered, or the stream ends '''
+        parts = [self.buf[self.pos:]]
+        length = len(parts[0])
+        while not self.eof and (length <= size or len(parts) == 1):
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.eof = True
+                chunk = self.decoder.decode(b'', final=True)
+            if isinstance(chunk, bytes):
+                chunk = self.decoder.decode(chunk)
+            parts.append(chunk)
+            length += len(chunk)
+
+        self.buf = ''.join(parts)
+        self.pos = 0
+
+    def peek(self) -> str:
+        ''' the next non whitespace character, without consuming it, '' at the end of the stream '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ''
+            self.more()
+
+    def expect(self, chars:str) -> str:
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError(f"expected one of '{chars}' at {self.pos}, got '{c}'")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer might continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            # the buffer is doubled before trying again, so a large value is not parsed over and over
+            self.more(2*(len(self.buf) - self.pos))
+
+
+def events(chunks):
+    ''' parses a workflow metadata document from chunks of bytes/str, yielding ('field', key, value) for the
+        top level fields and ('shard', call, shard) for every shard in calls, so the document is never held in memory '''
+
+    r = Reader(chunks)
+    r.expect('{')
+    if r.peek() == '}':
+        return
+
+    while True:
+        key = r.value()
+        r.expect(':')
+
+        if key == 'calls' and r.peek() == '{':
+            r.expect('{')
+            while r.peek() != '}':
+                call = r.value()
+                r.expect(':')
+                r.expect('[')
+                while r.peek() != ']':
+                    yield 'shard', call, r.value()
+                    if r.peek() == ',':
+                        r.expect(',')
+                r.expect(']')
+                if r.peek() == ',':
+                    r.expect(',')
+            r.expect('}')
+        else:
+            yield 'field', key, r.value()
+
+        if r.expect(',}') == '}':
+            return
+
+
+def file_chunks(fh, size:int=1024*1024):
+    return iter(lambda: fh.read(size), b'')
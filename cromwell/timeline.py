@@ -0,0 +1,125 @@
+import bisect
+
+import cromwell.calls as cromwell_calls
+
+
+# the keys the timeline does not need, the rest of the (expanded) metadata is streamed through
+exclude_keys = ['inputs', 'outputs', 'submittedFiles', 'commandLine', 'runtimeAttributes', 'labels', 'callCaching',
+                'jobId', 'stdout', 'stderr', 'backendLogs', 'failures']
+
+
+def shard_times(table:cromwell_calls.CallTable) -> list:
+    ''' start/end of each shard, and how the wall time splits into queueing (before the job runs) and running '''
+
+    res = []
+    for row in table.all():
+        start = cromwell_calls.timestamp(table.start[row])
+        end   = cromwell_calls.timestamp(table.end[row])
+        if start is None:
+            continue
+
+        run_start = cromwell_calls.timestamp(table.run_start[row])
+        run_end   = cromwell_calls.timestamp(table.run_end[row])
+
+        res.append({'parent': table.parent[row], 'call': table.call[row], 'shard': table.shard[row], 'attempt': table.attempt[row], 'status': table.status[row],
+                    'start': start, 'end': end,
+                    'wall': None if end is None else end - start,
+                    'queue': None if run_start is None else run_start - start,
+                    'run': None if run_start is None or run_end is None else run_end - run_start})
+
+    return res
+
+
+def concurrency(intervals:list) -> list:
+    ''' (time, running) at every point the number of running intervals changes '''
+
+    changes = []
+    for start, end in intervals:
+        changes.append((start, 1))
+        if end is not None:
+            changes.append((end, -1))
+
+    res = []
+    running = 0
+    for t, change in sorted(changes):
+        running += change
+        if res and res[-1][0] == t:
+            res[-1] = (t, running)
+        else:
+            res.append((t, running))
+
+    return res
+
+
+def call_summary(shards:list, now:float) -> list:
+    ''' per call: number of shards and retries, span from first start to last end, summed queue/run time and the
+        max number of shards running at the same time '''
+
+    calls = {}
+    for shard in shards:
+        calls.setdefault(shard['call'], []).append(shard)
+
+    res = []
+    for call, call_shards in calls.items():
+        start = min(s['start'] for s in call_shards)
+        end   = max(now if s['end'] is None else s['end'] for s in call_shards)
+        width = concurrency([(s['start'], s['end']) for s in call_shards])
+
+        res.append({'call': call,
+                    'shards': len(set((s['parent'], s['shard']) for s in call_shards)),
+                    'retries': len([s for s in call_shards if s['attempt'] > 1]),
+                    'start': start, 'end': end, 'wall': end - start,
+                    'queue': sum(s['queue'] or 0 for s in call_shards),
+                    'run': sum(s['run'] or 0 for s in call_shards),
+                    'longest': max((now - s['start'] if s['wall'] is None else s['wall']) for s in call_shards),
+                    'width': max(n for _, n in width)})
+
+    return sorted(res, key=lambda c: c['start'])
+
+
+def critical_path(shards:list) -> list:
+    ''' walks back from the shard that finished last, each step taking the shard that finished last before the
+        current one started. Without the task graph this is the chain of tasks the end time was waiting on '''
+
+    done = sorted([s for s in shards if s['end'] is not None], key=lambda s: (s['end'], s['start']))
+    if not done:
+        return []
+
+    ends = [s['end'] for s in done]
+    path = [done[-1]]
+    last = len(done) - 1
+    while True:
+        # only shards earlier in the end order, so zero length shards (cache hits) cannot be picked again
+        i = min(bisect.bisect_right(ends, path[-1]['start']), last)
+        if i == 0:
+            break
+        last = i - 1
+        path.append(done[last])
+
+    path.reverse()
+
+    res = []
+    for i, shard in enumerate(path):
+        gap = shard['start'] - path[i-1]['end'] if i > 0 else 0
+        res.append(dict(shard, gap=gap))
+
+    return res
+
+
+def timeline(wf_id:str, now:float) -> dict:
+
+    table = cromwell_calls.call_table(wf_id, exclude_keys=exclude_keys, expand_subworkflows=True)
+    fields = table.fields
+    if 'start' not in fields:
+        return {'id': wf_id, 'status': fields.get('status', None)}
+
+    shards = shard_times(table)
+    start = cromwell_calls.timestamp(fields['start'])
+    end   = cromwell_calls.timestamp(fields.get('end', None)) or now
+
+    return {'id': wf_id, 'name': fields.get('workflowName', None), 'status': fields.get('status', None),
+            'start': start, 'end': end, 'wall': end - start,
+            'calls': call_summary(shards, now),
+            'critical_path': critical_path(shards),
+            'width': concurrency([(s['start'], s['end']) for s in shards]),
+            'shards': shards}
@@ -1,13 +1,21 @@
 
 import re
 import os
+import json
 import sys
-import tempfile
+import glob
+import hashlib
 import shutil
+import zipfile
 import pytz
 
 import kbr.file_utils as file_utils
-import kbr.run_utils as run_utils
+
+pack_patterns = ['workflows/*wdl', 'tasks/*wdl', 'utils/*wdl', 'structs/*wdl', 'vars/*wdl', 'version.json']
+
+# rewritten workflow sources keyed by the sha1 of the original, and the last dependency zip read
+_wdl_sources = {}
+_dependency_zips = {}
 
 
 def read_args(filename:str) -> list:
@@ -93,28 +101,28 @@ def patch_workflow_imports(wdlfile:str, files:dict) -> None:
         fh.close()
 
 
-def fix_wdl_workflow_imports(wdlfile:str) -> None:
-
-#    wdlfile = "/home/brugger/projects/nsm/nsm-analysis/workflows/salmon.wdl"
-
-    tmpfile = tempfile.NamedTemporaryFile(mode="w", delete=False)
-#    print( tmpfile.name)
+def wdl_workflow_imports(wdlfile:str) -> str:
+    ''' the workflow source with its imports made relative, so they resolve against the dependency zip '''
 
-    # open and read in the while file as a single string
     with open( wdlfile, 'r') as fh:
-        for line in fh.readlines():
-            if line.startswith("import"):
-                g = re.match(r'import \".*?(\/.*)\"(.*)', line)
-                if (g):
-                    import_file = g.group(1)
-                    rest = g.group(2)
-                    line = f'import ".{import_file}"{rest}\n'
-            tmpfile.write( line )
-        fh.close()
+        content = fh.read()
+
+    key = hashlib.sha1(content.encode()).hexdigest()
+    if key in _wdl_sources:
+        return _wdl_sources[ key ]
 
-    tmpfile.close()
+    lines = []
+    for line in content.splitlines(keepends=True):
+        if line.startswith("import"):
+            g = re.match(r'import \".*?(\/.*)\"(.*)', line)
+            if (g):
+                import_file = g.group(1)
+                rest = g.group(2)
+                line = f'import ".{import_file}"{rest}\n'
+        lines.append( line )
 
-    return tmpfile.name
+    _wdl_sources[ key ] = "".join(lines)
+    return _wdl_sources[ key ]
 
 
 def patch_version_location(path:str=".") -> None:
@@ -150,9 +158,67 @@ def is_id(value:str) -> bool:
     return False
 
 
-def pack_dir(filename:str, path:str=None):
+def fingerprint(wdl_source:str, inputs) -> str:
+    ''' identifies a submission by its workflow source and inputs, key order in the inputs does not matter '''
+
+    wdl_hash = hashlib.sha1(wdl_source.encode()).hexdigest()
+    inputs_hash = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    return hashlib.sha1(f"{wdl_hash}:{inputs_hash}".encode()).hexdigest()
+
+
+def _sha1(filename:str) -> str:
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024*1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def pack_dir(filename:str, path:str=None) -> str:
+    ''' zips the wdl tree, the zip is only rebuilt if the content of the files has changed since it was made '''
+
+    path = path or "."
+
+    files = []
+    for pattern in pack_patterns:
+        files += sorted(glob.glob(os.path.join(path, pattern)))
+
+    digest = hashlib.sha1()
+    for f in files:
+        digest.update(f"{os.path.relpath(f, path)}\0{_sha1(f)}\n".encode())
+    digest = digest.hexdigest().encode()
+
+    # the digest of the sources is kept as the zip comment
+    zipname = os.path.join(path, filename)
+    if os.path.isfile(zipname):
+        try:
+            with zipfile.ZipFile(zipname) as zf:
+                if zf.comment == digest:
+                    return zipname
+        except zipfile.BadZipFile:
+            pass
+
+    tmpfile = f"{zipname}.tmp"
+    with zipfile.ZipFile(tmpfile, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for f in files:
+            zf.write(f, os.path.relpath(f, path))
+        zf.comment = digest
+    os.replace(tmpfile, zipname)
+
+    return zipname
+
+
+def dependency_zip(filename:str) -> bytes:
+    ''' content of a dependency zip, read once and reused for as long as the file is unchanged '''
+
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size)
+    if key not in _dependency_zips:
+        _dependency_zips.clear()
+        with open(filename, 'rb') as fh:
+            _dependency_zips[ key ] = fh.read()
 
-    cmd = f'zip {filename} workflows/*wdl tasks/*wdl utils/*wdl structs/*wdl vars/*wdl version.json'
-    run_utils.launch_cmd(cmd, cwd=path)
+    return _dependency_zips[ key ]
 
 
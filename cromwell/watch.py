@@ -0,0 +1,114 @@
+import time
+from datetime import datetime
+
+import cromwell.api as cromwell_api
+import cromwell.cache as cromwell_cache
+import cromwell.calls as cromwell_calls
+import cromwell.facade as cromwell_facade
+
+
+active_states = ['Submitted', 'On Hold', 'Running', 'Aborting']
+
+# ids the server does not know are given this state, so they are not polled again
+not_found = 'Not Found'
+
+min_interval = 10
+max_interval = 300
+backoff = 1.5
+
+
+def next_interval(interval:float, changed:bool, low:float=None, high:float=None) -> float:
+    ''' back to the shortest interval after a change, otherwise slowly back off to the longest '''
+    low  = min_interval if low is None else low
+    high = max_interval if high is None else high
+
+    if changed:
+        return low
+    return min(interval * backoff, high)
+
+
+def poll(ids:list, filters:dict=None) -> dict:
+    ''' wf_id -> query row for the ids and the workflows matching the filters, in as few /query requests as possible.
+        Raises a QueryError if a query fails '''
+
+    rows = {}
+    if filters is not None:
+        filters = dict(filters)
+        # only the workflows that can still change, the ones finishing since the last poll are picked up by id below
+        if not filters.get('status', None):
+            filters['status'] = active_states
+        for r in cromwell_facade.query_workflows(**filters):
+            rows[ r['id'] ] = r
+
+    missing = [wf_id for wf_id in ids if wf_id not in rows]
+    if missing:
+        for r in cromwell_facade.query_workflows(ids=missing):
+            rows[ r['id'] ] = r
+
+    return rows
+
+
+def call_states(wf_id:str) -> dict:
+    ''' (call, shard) -> status of the latest attempt '''
+
+    table = cromwell_calls.call_table(wf_id, include_keys=cromwell_facade.meta_keys['calls'] + ['shardIndex', 'attempt'])
+
+    res = {}
+    latest = {}
+    for row in table.all():
+        key = (table.call[row], table.shard[row])
+        if table.attempt[row] >= latest.get(key, 0):
+            latest[ key ] = table.attempt[row]
+            res[ key ] = table.status[row]
+
+    return res
+
+
+def watch(ids:list=None, filters:dict=None, calls:bool=False, low:float=None, high:float=None) -> None:
+    ''' prints the state transitions of the workflows until they are all done, with filters it runs until stopped '''
+
+    states = {wf_id: None for wf_id in ids or []}
+    shard_states = {}
+    interval = min_interval if low is None else low
+
+    while True:
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        active = [wf_id for wf_id, state in states.items() if state not in cromwell_cache.terminal_states + [not_found]]
+        try:
+            rows = poll(active, filters)
+        except cromwell_api.QueryError as e:
+            # the last known states are kept, and the server is given more time before the next poll
+            print(f"{now}\t{e}")
+            interval = next_interval(interval, False, low, high)
+            time.sleep(interval)
+            continue
+
+        changed = False
+        for wf_id in active + [wf_id for wf_id in rows if wf_id not in states]:
+            state = rows[wf_id]['status'] if wf_id in rows else not_found
+            if state != states.get(wf_id, None):
+                name = rows[wf_id].get('name', 'NA') if wf_id in rows else 'NA'
+                print(f"{now}\t{wf_id}\t{name}\t{states.get(wf_id, None) or 'new'} -> {state}")
+                states[ wf_id ] = state
+                changed = True
+
+        if calls:
+            # the workflows that were active at this poll, the calls of ones that just finished are checked a last time
+            for wf_id in [wf_id for wf_id in states if wf_id in active or wf_id in rows]:
+                if states[wf_id] == not_found:
+                    continue
+                new = call_states(wf_id)
+                old = shard_states.get(wf_id, None)
+                if old is not None:
+                    for (call, shard), state in sorted(new.items(), key=lambda s: (s[0][0], s[0][1])):
+                        if old.get((call, shard), None) != state:
+                            shard_name = call if shard < 0 else f"{call}:{shard}"
+                            print(f"{now}\t{wf_id}\t{shard_name}\t{old.get((call, shard), None) or 'new'} -> {state}")
+                            changed = True
+                shard_states[ wf_id ] = new
+
+        if filters is None and all(state in cromwell_cache.terminal_states + [not_found] for state in states.values()):
+            break
+
+        interval = next_interval(interval, changed, low, high)
+        time.sleep(interval)